@@ -3,10 +3,13 @@
 当余额低于30元时，发送提醒
 """
 
+import json
 import logging
 import os
 import sys
 import asyncio
+import functools
+import time
 from datetime import datetime, timedelta
 
 # 添加项目根目录到sys.path
@@ -15,57 +18,243 @@ sys.path.append(
 )
 
 from app.scripts.QFNUElectricityQuery.DataManager import DataManager
+from app.scripts.QFNUElectricityQuery.Storage import DATA_DIR, fcntl
+from app.scripts.QFNUElectricityQuery.ShardLease import (
+    ShardLease,
+    shard_of,
+    merge_json_locked,
+)
 from app.scripts.QFNUElectricityQuery.ElectricityQuery import ElectricityQuery
+from app.scripts.QFNUElectricityQuery.BalanceHistory import get_history
+from app.scripts.QFNUElectricityQuery.PollScheduler import PollScheduler
+from app.scripts.QFNUElectricityQuery.FailureTracker import FailureTracker
+from app.scripts.QFNUElectricityQuery.GroupMessageQueue import GroupMessageQueue
+from app.scripts.QFNUElectricityQuery.Metrics import metrics
 from app.api import send_group_msg
 
 
 class BalanceAlertManager:
+    # 进程内唯一的实例
+    _instance = None
+
+    @classmethod
+    def get_instance(cls):
+        """获取进程内共享的提醒管理器，状态在首次巡检前从存储加载一次"""
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    async def shutdown(cls):
+        """停止共享实例的后台巡检任务"""
+        if cls._instance is not None:
+            await cls._instance.stop()
+
     def __init__(self):
         # 阈值
         self.threshold = 30
         # 提醒间隔（小时）
         self.alert_interval = 24
+        # 巡检时同时查询的openID数量上限
+        self.sweep_concurrency = int(os.getenv("QFNUEQ_SWEEP_CONCURRENCY", "10"))
+        # 巡检窗口（秒），每个openID在窗口内有固定的检查时刻，检查均匀分散在整个窗口中
+        self.sweep_interval = float(os.getenv("QFNUEQ_SWEEP_INTERVAL", "3600"))
+        # 后台任务每隔多少秒检查一次到期的openID
+        self.sweep_tick = min(
+            self.sweep_interval, float(os.getenv("QFNUEQ_SWEEP_TICK", "60"))
+        )
+        # 按耗电速度自适应安排每个openID的检查时间，最短间隔不小于巡检窗口
+        self.poll_scheduler = PollScheduler(
+            self.threshold,
+            min_interval=max(
+                self.sweep_interval,
+                float(os.getenv("QFNUEQ_POLL_MIN_INTERVAL", "3600")),
+            ),
+            max_interval=float(os.getenv("QFNUEQ_POLL_MAX_INTERVAL", "172800")),
+            window=self.sweep_interval,
+        )
+        # 巡检检查点，保存每个openID的下次检查时间，重启后从中断处继续
+        self.checkpoint_path = os.getenv(
+            "QFNUEQ_SWEEP_CHECKPOINT", os.path.join(DATA_DIR, "sweep_checkpoint.json")
+        )
+        self._checkpoint_loaded = False
+        # 检查点的保存间隔（秒），期间的变化只记在内存中，停止时保存
+        self.checkpoint_interval = float(os.getenv("QFNUEQ_CHECKPOINT_INTERVAL", "300"))
+        self._checkpoint_dirty = False
+        self._last_checkpoint_save = time.monotonic()
+        # 查询失败的openID按指数退避推迟巡检，连续查不到户号时标记为失效
+        self.failures = FailureTracker(
+            os.getenv("QFNUEQ_QUARANTINE_FILE", os.path.join(DATA_DIR, "quarantine.json")),
+            base_backoff=float(
+                os.getenv("QFNUEQ_QUARANTINE_BASE_BACKOFF", str(self.sweep_interval))
+            ),
+            max_backoff=float(os.getenv("QFNUEQ_QUARANTINE_MAX_BACKOFF", "86400")),
+            stale_after=int(os.getenv("QFNUEQ_STALE_AFTER", "3")),
+        )
+        # openID被标记为失效时是否在群里通知绑定的用户
+        self.notify_stale = os.getenv("QFNUEQ_STALE_NOTIFY", "1") != "0"
+        # 多进程共用数据目录时按群号分片，每个进程只巡检租到的分片；为1时不分片
+        self.shard_count = int(os.getenv("QFNUEQ_SWEEP_SHARDS", "1"))
+        self.leases = None
+        if self.shard_count > 1:
+            if fcntl is None:
+                logging.warning("当前系统不支持文件锁，多进程分片巡检无法保证互斥")
+            self.leases = ShardLease(
+                os.path.join(DATA_DIR, "leases"),
+                self.shard_count,
+                ttl=float(os.getenv("QFNUEQ_SHARD_LEASE_TTL", str(self.sweep_tick * 3))),
+                worker_id=os.getenv("QFNUEQ_WORKER_ID") or None,
+            )
+        # 跨群索引启动时建立一次，之后随绑定/解绑增量更新；
+        # 每隔该秒数在线程中重建一次，纳入其他进程或手动修改的数据，0表示不重建
+        self.index_rebuild_interval = float(os.getenv("QFNUEQ_INDEX_REBUILD_INTERVAL", "3600"))
+        self._last_index_rebuild = None
+        # 群号对应的分片缓存 {group_id: shard}，以及本进程当前负责的openID
+        self._group_shards = {}
+        self._owned_openids = None
+        # 估计耗电速度时参考的历史天数
+        self.burn_rate_days = int(os.getenv("QFNUEQ_BURN_RATE_DAYS", "3"))
+        # 最近估计出的耗电速度 {openid: 元/天}
+        self.burn_rates = {}
+        # 提醒消息按群合并，单条消息超过该长度时拆分
+        self.alert_max_length = int(os.getenv("QFNUEQ_ALERT_MAX_LENGTH", "1500"))
+        # 每个群独立的发送队列，同一群两条消息之间至少间隔该秒数
+        self.message_queue = GroupMessageQueue(
+            send_group_msg, float(os.getenv("QFNUEQ_GROUP_SEND_INTERVAL", "1"))
+        )
+        # 后台巡检任务及发送提醒使用的websocket
+        self._sweep_task = None
+        self._websocket = None
+        # 余额历史记录的压缩间隔（秒）及上次压缩时间
+        self.history_compact_interval = 86400
+        self._last_history_compact = None
         # 记录上次提醒时间 {group_id: {user_id: timestamp}}
         self.last_alert_time = {}
+        # 已发出、尚未写入存储的提醒时间 {group_id: {user_id: timestamp}}
+        self._pending_alert_times = {}
+        # 分片巡检时已认领但未能发出的提醒 [(group_id, user_ids, 认领时间)]，下次保存时撤销认领
+        self._unsent_claims = []
+        # 停止时等待发送队列清空的最长时间（秒），超时后未发出的提醒不记录提醒时间
+        self.stop_drain_timeout = float(os.getenv("QFNUEQ_STOP_DRAIN_TIMEOUT", "5"))
         self.electricity_query = ElectricityQuery()
 
-        # 定义数据目录，与DataManager保持一致
-        base_dir = os.path.dirname(
-            os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        )
-        self.DATA_DIR = os.path.join(base_dir, "data", "QFNUElectricityQuery")
-        os.makedirs(self.DATA_DIR, exist_ok=True)
-
-        # 从本地文件恢复各群组的提醒时间记录
-        self._load_alert_times_from_disk()
+        # 提醒时间记录是否已从存储中恢复
+        self._alert_times_loaded = False
 
-    def _load_alert_times_from_disk(self):
-        """从磁盘加载所有群组的提醒时间记录"""
+    async def _load_alert_times_from_disk(self):
+        """从存储加载所有群组的提醒时间记录"""
         try:
-            if not os.path.exists(self.DATA_DIR):
-                return
-
-            # 遍历数据目录下的所有群组数据文件
-            for filename in os.listdir(self.DATA_DIR):
-                if filename.endswith(".json"):
-                    group_id = filename.split(".")[0]
-
-                    # 加载该群组的提醒时间记录
-                    data_manager = DataManager(group_id)
-                    last_alert_times = data_manager.load_last_alert_time()
-                    if last_alert_times:
-                        self.last_alert_time[group_id] = last_alert_times
+            self.last_alert_time.update(await DataManager.all_last_alert_times())
+            self._alert_times_loaded = True
         except Exception as e:
             logging.error(f"加载提醒时间记录时出错: {e}")
 
-    def _save_alert_time(self, group_id):
-        """保存指定群组的提醒时间记录到磁盘"""
-        try:
-            if group_id in self.last_alert_time:
+    async def flush_alert_times(self):
+        """将已发出的提醒时间按群组一次性写入存储，并撤销未能发出的提醒的认领"""
+        unsent, self._unsent_claims = self._unsent_claims, []
+        for group_id, user_ids, claimed_at in unsent:
+            await DataManager(group_id).release_alerts(user_ids, claimed_at)
+        pending, self._pending_alert_times = self._pending_alert_times, {}
+        for group_id, alert_times in pending.items():
+            try:
                 data_manager = DataManager(group_id)
-                data_manager.save_last_alert_time(self.last_alert_time[group_id])
+                if not await data_manager.update_last_alert_time(alert_times):
+                    # 写入失败时保留，等待下次刷新重试（不覆盖期间产生的新记录）
+                    retry = self._pending_alert_times.setdefault(group_id, {})
+                    for user_id, timestamp in alert_times.items():
+                        retry.setdefault(user_id, timestamp)
+            except Exception as e:
+                logging.error(f"保存群组 {group_id} 的提醒时间记录时出错: {e}")
+
+    async def _load_checkpoint(self):
+        """从检查点恢复各openID的下次检查时间，检查点不存在或损坏时从头安排"""
+        self._checkpoint_loaded = True
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+        try:
+            checkpoint = await asyncio.to_thread(_read_json, self.checkpoint_path)
+            restored = self.poll_scheduler.restore(
+                checkpoint.get("due", {}), time.time(), catch_up=self.sweep_tick * 5
+            )
+            logging.info(
+                f"已从巡检检查点恢复 {restored} 个openID的检查时间"
+                f"（上次保存于 {datetime.fromtimestamp(checkpoint.get('saved_at', 0))}）"
+            )
+        except Exception as e:
+            logging.error(f"读取巡检检查点 {self.checkpoint_path} 时出错: {e}")
+
+    async def save_checkpoint(self, force=True):
+        """保存各openID的下次检查时间
+
+        force为False时只在有变化且距上次保存超过checkpoint_interval时保存
+        """
+        if not self.checkpoint_path:
+            return
+        now = time.monotonic()
+        if not force and not (
+            self._checkpoint_dirty
+            and now - self._last_checkpoint_save >= self.checkpoint_interval
+        ):
+            return
+        self._checkpoint_dirty = False
+        self._last_checkpoint_save = now
+        try:
+            # 分片巡检时只替换本进程负责的openID，保留其他进程写入的部分
+            await asyncio.to_thread(
+                merge_json_locked,
+                self.checkpoint_path,
+                "due",
+                self.poll_scheduler.state(),
+                self._owned_openids,
+            )
         except Exception as e:
-            logging.error(f"保存群组 {group_id} 的提醒时间记录时出错: {e}")
+            self._checkpoint_dirty = True
+            logging.error(f"保存巡检检查点 {self.checkpoint_path} 时出错: {e}")
+
+    def _shard_of_group(self, group_id):
+        shard = self._group_shards.get(group_id)
+        if shard is None:
+            shard = self._group_shards[group_id] = shard_of(group_id, self.shard_count)
+        return shard
+
+    async def _claim_shards(self, targets):
+        """续约分片租约，只保留本进程负责的openID
+
+        绑定在多个群的openID由其中分片号最小的群所在的进程负责，
+        保证每个openID在所有进程中只被查询一次
+        """
+        previous = self.leases.owned
+        owned = await asyncio.to_thread(self.leases.renew)
+        if owned - previous:
+            # 接管了新的分片，重新读取检查点和隔离状态，接着其他进程的进度继续
+            await self._load_checkpoint()
+            await asyncio.to_thread(self.failures.load)
+        # 续约期间被解绑的openID对应的集合可能已为空
+        targets = {
+            openid: members
+            for openid, members in targets.items()
+            if members
+            and min(self._shard_of_group(group_id) for group_id, _ in members) in owned
+        }
+        self._owned_openids = set(targets)
+        return targets
+
+    async def _claim_alerts(self, candidates, now):
+        """分片巡检时通过存储认领提醒，其他进程已提醒过的用户不再重复提醒"""
+        alerts = {}
+        interval = timedelta(hours=self.alert_interval)
+        for group_id, entries in candidates.items():
+            claimed = set(
+                await DataManager(group_id).claim_alerts(
+                    [user_id for user_id, _, _ in entries], now, interval
+                )
+            )
+            entries = [entry for entry in entries if entry[0] in claimed]
+            if entries:
+                alerts[group_id] = entries
+                for user_id in claimed:
+                    self.last_alert_time.setdefault(group_id, {})[user_id] = now
+        return alerts
 
     def should_alert(self, group_id, user_id):
         """检查是否应该发送提醒（避免频繁提醒）"""
@@ -75,61 +264,281 @@ class BalanceAlertManager:
 
         last_time = self.last_alert_time[group_id].get(user_id)
         if not last_time or now - last_time > timedelta(hours=self.alert_interval):
+            # 先记录在内存中，提醒发出后由 _alert_done 记录待保存
             self.last_alert_time[group_id][user_id] = now
-            # 保存提醒时间到本地
-            self._save_alert_time(group_id)
             return True
         return False
 
-    async def check_balance_for_user(self, group_id, user_id, openid):
-        """检查单个用户的电费余额"""
+    def _alert_done(self, group_id, user_ids, sent):
+        """一条提醒消息发送完成（或被丢弃）后调用"""
+        times = self.last_alert_time.get(group_id, {})
+        if sent:
+            if self.leases is None:
+                pending = self._pending_alert_times.setdefault(group_id, {})
+                for user_id in user_ids:
+                    if user_id in times:
+                        pending[user_id] = times[user_id]
+            return
+        # 未能发出：撤销内存中的提醒时间，下次检查到余额不足时重新提醒
+        alerted = {user_id: times.pop(user_id) for user_id in user_ids if user_id in times}
+        if self.leases is not None:
+            for claimed_at in set(alerted.values()):
+                self._unsent_claims.append(
+                    (group_id, [u for u, t in alerted.items() if t == claimed_at], claimed_at)
+                )
+
+    async def _collect_targets(self):
+        """汇总所有群组的绑定关系
+
+        Returns:
+            dict: {openid: {(group_id, user_id), ...}}，同一openID只出现一次
+        """
+        now = time.monotonic()
+        if self._last_index_rebuild is None:
+            index = await DataManager.get_index()
+            self._last_index_rebuild = now
+        elif self.index_rebuild_interval > 0 and (
+            now - self._last_index_rebuild >= self.index_rebuild_interval
+        ):
+            index = await DataManager.rebuild_index()
+            self._last_index_rebuild = now
+        else:
+            index = await DataManager.get_index()
+        return index.targets()
+
+    async def _fetch_balances(self, openids, now):
+        """在并发上限内以后台优先级查询一批openID的余额，并记录失败情况
+
+        Returns:
+            tuple: ({openid: balance 或 None}, 本轮刚被标记为失效的openID列表)
+        """
+        results = await self.electricity_query.query_many(openids, self.sweep_concurrency)
+        balances = {}
+        stale = []
+        for openid, result in results.items():
+            balances[openid] = result.balance if result.ok else None
+            if self.failures.record(openid, result, now):
+                stale.append(openid)
+        return balances, stale
+
+    async def _reschedule(self, balances, now):
+        """根据本次查询结果估计耗电速度，并安排每个openID的下次检查时间"""
+        history = get_history()
+        checked = [openid for openid, balance in balances.items() if balance is not None]
+        try:
+            rates = await asyncio.to_thread(
+                lambda: {
+                    openid: history.burn_rate(openid, self.burn_rate_days)
+                    for openid in checked
+                }
+            )
+        except Exception as e:
+            logging.error(f"估计耗电速度时出错: {e}")
+            rates = {}
+        for openid, balance in balances.items():
+            rate = rates.get(openid)
+            if rate is not None:
+                self.burn_rates[openid] = rate
+            # 被隔离的openID至少等到退避结束再检查
+            self.poll_scheduler.schedule(
+                openid, balance, rate, now, not_before=self.failures.next_attempt(openid)
+            )
+
+    def _queue_stale_notices(self, websocket, stale, targets):
+        """通知绑定了失效openID的用户，每个openID只通知一次"""
+        notices = {}  # {group_id: [user_id, ...]}
+        for openid in stale:
+            for group_id, user_id in targets.get(openid, ()):
+                notices.setdefault(group_id, []).append(user_id)
+            self.failures.mark_notified(openid)
+        for group_id, user_ids in notices.items():
+            mentions = " ".join(f"[CQ:at,qq={user_id}]" for user_id in user_ids)
+            self.message_queue.put(
+                websocket,
+                group_id,
+                f"{mentions}\n⚠️ 你绑定的电费账号连续 {self.failures.stale_after} 次查不到户号信息，"
+                "已降低自动检查频率。请确认已在物业登记新校区宿舍户号，或使用【电费绑定 链接】重新绑定。",
+            )
+
+    async def save_failures(self):
+        """保存查询失败的隔离状态"""
+        snapshot = self.failures.snapshot()
+        if snapshot is None:
+            return
         try:
-            result = await self.electricity_query.parse_result(openid)
-            if result and "data" in result:
-                balance = float(result["data"]["yue"])
-                if balance < self.threshold and self.should_alert(group_id, user_id):
-                    return user_id, balance
-            return None, 0
+            await asyncio.to_thread(self.failures.save, snapshot, self._owned_openids)
         except Exception as e:
-            logging.error(f"检查用户 {user_id} 余额时出错: {e}")
-            return None, 0
+            self.failures.mark_dirty()
+            logging.error(f"保存隔离状态 {self.failures.path} 时出错: {e}")
+
+    def _days_until_empty(self, openid, balance):
+        """根据耗电速度生成"预计可用天数"提示，无法估计时返回空字符串"""
+        rate = self.burn_rates.get(openid)
+        if not rate or rate <= 0:
+            return ""
+        return f"，预计还能用约 {balance / rate:.1f} 天"
+
+    def _build_alert_messages(self, entries):
+        """将同一群的多条提醒合并为尽量少的消息
+
+        Args:
+            entries: [(user_id, balance, days_left), ...]
+
+        Returns:
+            list: [(消息文本, 消息中的user_id列表), ...]，每条不超过alert_max_length
+        """
+        header = f"⚡ 电费余额提醒（低于 {self.threshold} 元）"
+        footer = "请及时充值以避免断电！"
+        messages = []
+        lines = []
+        user_ids = []
+        length = len(header) + len(footer)
+        for user_id, balance, days_left in sorted(entries, key=lambda e: e[1]):
+            line = f"[CQ:at,qq={user_id}]({user_id}) 余额 {balance:.2f} 元{days_left}"
+            if lines and length + len(line) + 1 > self.alert_max_length:
+                messages.append(("\n".join([header, *lines, footer]), user_ids))
+                lines = []
+                user_ids = []
+                length = len(header) + len(footer)
+            lines.append(line)
+            user_ids.append(user_id)
+            length += len(line) + 1
+        if lines:
+            messages.append(("\n".join([header, *lines, footer]), user_ids))
+        return messages
 
     async def check_and_alert(self, websocket):
         """检查所有用户余额并发送提醒"""
+        sweep_start = time.perf_counter()
         try:
-            # 确保数据目录存在
-            if not os.path.exists(self.DATA_DIR):
-                return
-
-            # 遍历数据目录下的所有群组数据文件
-            for filename in os.listdir(self.DATA_DIR):
-                if filename.endswith(".json"):
-                    group_id = filename.split(".")[0]
-
-                    # 获取该群组的所有绑定用户
-                    data_manager = DataManager(group_id)
-                    bindings = data_manager.get_all_bindings()
-
-                    # 检查每个用户的电费余额
-                    for user_id, openid in bindings.items():
-                        alert_user_id, balance = await self.check_balance_for_user(
-                            group_id, user_id, openid
-                        )
-
-                        # 如果需要提醒，发送消息
-                        if alert_user_id:
-                            alert_msg = (
-                                f"[CQ:at,qq={user_id}]({user_id}) 电费余额提醒！\n"
-                                f"您的电费余额仅剩 {balance:.2f} 元，已低于 {self.threshold} 元，"
-                                f"请及时充值以避免断电！"
-                            )
-                            await send_group_msg(websocket, group_id, alert_msg)
-                            logging.info(
-                                f"已向群 {group_id} 的用户 {user_id} 发送电费余额提醒"
-                            )
-
-                            # 避免一次性发送太多消息导致风控
-                            await asyncio.sleep(1)
+            if not self._alert_times_loaded:
+                await self._load_alert_times_from_disk()
+            if not self._checkpoint_loaded:
+                await self._load_checkpoint()
+            if not self.failures.loaded:
+                await asyncio.to_thread(self.failures.load)
+
+            # 先汇总去重，同一openID在多个群绑定时只查询一次
+            targets = await self._collect_targets()
+            if self.leases is not None:
+                targets = await self._claim_shards(targets)
+            # 只检查已到检查时刻的openID，新出现的openID安排到它在窗口内的时刻
+            now = time.time()
+            scheduled = len(self.poll_scheduler)
+            due = self.poll_scheduler.pop_due(targets, now)
+            balances, stale = await self._fetch_balances(due, now)
+            await self._reschedule(balances, now)
+            self.failures.forget(targets)
+            if stale and self.notify_stale:
+                self._queue_stale_notices(websocket, stale, targets)
+            if balances or len(self.poll_scheduler) != scheduled:
+                self._checkpoint_dirty = True
+            await self.save_checkpoint(force=False)
+
+            # 将查询结果分发给绑定该openID的每个群成员，按群汇总
+            alerts = {}  # {group_id: [(user_id, balance, days_left), ...]}
+            for openid, balance in balances.items():
+                if balance is None or balance >= self.threshold:
+                    continue
+                days_left = self._days_until_empty(openid, balance)
+                for group_id, user_id in targets.get(openid, ()):
+                    # 分片巡检时由存储统一判断是否重复提醒
+                    if self.leases is not None or self.should_alert(group_id, user_id):
+                        alerts.setdefault(group_id, []).append((user_id, balance, days_left))
+            if self.leases is not None:
+                alerts = await self._claim_alerts(alerts, datetime.now())
+
+            # 每个群合并成一条（过长时拆分）消息，交给各群的发送队列独立限速发送
+            for group_id, entries in alerts.items():
+                for alert_msg, user_ids in self._build_alert_messages(entries):
+                    self.message_queue.put(
+                        websocket,
+                        group_id,
+                        alert_msg,
+                        on_done=functools.partial(self._alert_done, group_id, user_ids),
+                    )
+                logging.info(f"已向群 {group_id} 的 {len(entries)} 位用户发送电费余额提醒")
+
+            alert_count = sum(len(entries) for entries in alerts.values())
+            metrics.inc("qfnueq_sweeps_total")
+            metrics.inc("qfnueq_sweep_openids_checked_total", len(balances))
+            metrics.inc("qfnueq_alerts_total", alert_count)
+            metrics.set_gauge("qfnueq_sweep_openids_tracked", len(targets))
+            metrics.set_gauge("qfnueq_sweep_openids_checked", len(balances))
+            metrics.set_gauge("qfnueq_sweep_alerts", alert_count)
+            metrics.set_gauge("qfnueq_quarantined_openids", len(self.failures))
+            metrics.set_gauge("qfnueq_stale_openids", self.failures.stale_count())
 
         except Exception as e:
+            metrics.inc("qfnueq_sweep_errors_total")
             logging.error(f"检查电费余额并发送提醒时出错: {e}")
+        finally:
+            await self.flush_alert_times()
+            await self.save_failures()
+            elapsed = time.perf_counter() - sweep_start
+            metrics.observe("qfnueq_sweep_seconds", elapsed)
+            metrics.set_gauge("qfnueq_sweep_last_seconds", round(elapsed, 3))
+            metrics.set_gauge("qfnueq_sweep_last_timestamp", int(time.time()))
+            metrics.set_gauge("qfnueq_message_queue_pending", self.message_queue.pending())
+
+    def start(self, websocket):
+        """启动后台巡检任务（已在运行时只更新websocket），立即返回"""
+        self._websocket = websocket
+        if self._sweep_task is None or self._sweep_task.done():
+            self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        """停止后台巡检任务"""
+        task = self._sweep_task
+        self._sweep_task = None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        # 先等待已排队的提醒发出，超时后丢弃剩余消息，被丢弃的提醒不记录提醒时间
+        if not await self.message_queue.join(self.stop_drain_timeout):
+            dropped = await self.message_queue.close()
+            logging.warning(f"停止时仍有 {dropped} 条消息未发出，已丢弃，下次启动后重新提醒")
+        await self.flush_alert_times()
+        if self._checkpoint_loaded and self._checkpoint_dirty:
+            await self.save_checkpoint()
+        await self.save_failures()
+        if self.leases is not None:
+            await asyncio.to_thread(self.leases.release)
+
+    async def _maybe_compact_history(self):
+        """距上次压缩超过间隔时，在线程中压缩余额历史记录"""
+        now = time.monotonic()
+        if (
+            self._last_history_compact is not None
+            and now - self._last_history_compact < self.history_compact_interval
+        ):
+            return
+        self._last_history_compact = now
+        try:
+            removed = await asyncio.to_thread(get_history().compact_all)
+            if removed:
+                logging.info(f"已压缩余额历史记录，删除 {removed} 条旧记录")
+        except Exception as e:
+            logging.error(f"压缩余额历史记录时出错: {e}")
+
+    async def _sweep_loop(self):
+        """每隔sweep_tick秒检查一次到期的openID，同一时间只有一轮在运行"""
+        while True:
+            started = time.monotonic()
+            await self.check_and_alert(self._websocket)
+            await self._maybe_compact_history()
+            elapsed = time.monotonic() - started
+            if elapsed > self.sweep_tick:
+                logging.warning(
+                    f"电费余额巡检耗时 {elapsed:.1f} 秒，超过检查间隔，跳过错过的轮次"
+                )
+            # 对齐到下一个检查时刻，耗时超过间隔时跳过错过的轮次
+            await asyncio.sleep(self.sweep_tick - elapsed % self.sweep_tick)
+
+
+def _read_json(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
@@ -0,0 +1,237 @@
+"""
+余额历史记录
+每个openID一个只追加的二进制文件，每条记录为定长的 (时间戳, 余额分)
+"""
+
+import os
+import re
+import sys
+import struct
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime, timedelta
+
+# 添加项目根目录到sys.path
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.QFNUElectricityQuery.Storage import DATA_DIR
+
+# 每条记录：uint32 Unix时间戳 + int32 余额（单位：分），小端，共8字节
+RECORD = struct.Struct("<Ii")
+
+_SAFE_OPENID = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+class BalanceHistory:
+    def __init__(self, history_dir):
+        self.history_dir = history_dir
+        os.makedirs(self.history_dir, exist_ok=True)
+        # 与上一条记录余额相同且间隔小于该值（秒）时不再追加
+        self.min_interval = int(os.getenv("QFNUEQ_HISTORY_MIN_INTERVAL", "600"))
+        # 超过该天数的记录降采样为每小时一条
+        self.hourly_after_days = int(os.getenv("QFNUEQ_HISTORY_HOURLY_AFTER_DAYS", "7"))
+        # 超过该天数的记录降采样为每天一条
+        self.daily_after_days = int(os.getenv("QFNUEQ_HISTORY_DAILY_AFTER_DAYS", "30"))
+        # 超过该天数的记录直接删除
+        self.retention_days = int(os.getenv("QFNUEQ_HISTORY_RETENTION_DAYS", "365"))
+        self._lock = threading.Lock()
+
+    def _path(self, openid):
+        # openID一般只包含字母数字，否则使用哈希作为文件名
+        if _SAFE_OPENID.match(openid):
+            name = openid
+        else:
+            name = hashlib.sha1(openid.encode("utf-8")).hexdigest()
+        return os.path.join(self.history_dir, f"{name}.bin")
+
+    @staticmethod
+    def _read_record(f, index):
+        f.seek(index * RECORD.size)
+        return RECORD.unpack(f.read(RECORD.size))
+
+    def _bisect(self, f, count, timestamp):
+        """返回第一条时间戳 >= timestamp 的记录下标"""
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._read_record(f, mid)[0] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def append(self, openid, balance, timestamp=None):
+        """追加一条余额记录"""
+        timestamp = int(timestamp if timestamp is not None else datetime.now().timestamp())
+        cents = int(round(balance * 100))
+        path = self._path(openid)
+        with self._lock:
+            with open(path, "ab+") as f:
+                size = f.tell()
+                # 丢弃结尾不完整的记录（例如写入时进程崩溃）
+                if size % RECORD.size:
+                    size -= size % RECORD.size
+                    f.truncate(size)
+                if size:
+                    last_ts, last_cents = self._read_record(f, size // RECORD.size - 1)
+                    if timestamp < last_ts:
+                        return False
+                    if last_cents == cents and timestamp - last_ts < self.min_interval:
+                        return False
+                f.seek(size)
+                f.write(RECORD.pack(timestamp, cents))
+        return True
+
+    def read_range(self, openid, start_ts, end_ts, include_previous=False):
+        """读取 [start_ts, end_ts] 内的记录，通过二分查找定位，不读取整个文件
+
+        Args:
+            include_previous: 是否额外包含start_ts之前的最后一条记录（用于计算区间起点的余额）
+
+        Returns:
+            list: [(timestamp, balance), ...]
+        """
+        path = self._path(openid)
+        try:
+            with open(path, "rb") as f:
+                count = os.fstat(f.fileno()).st_size // RECORD.size
+                start = self._bisect(f, count, start_ts)
+                if include_previous and start > 0:
+                    start -= 1
+                end = self._bisect(f, count, end_ts + 1)
+                f.seek(start * RECORD.size)
+                data = f.read((end - start) * RECORD.size)
+        except FileNotFoundError:
+            return []
+        return [(ts, cents / 100) for ts, cents in RECORD.iter_unpack(data)]
+
+    def daily_consumption(self, openid, days, now=None):
+        """统计最近days天每天的用电金额（余额的下降量，充值不计入）
+
+        Returns:
+            list: [(date, consumption), ...]，按日期升序，没有记录时返回空列表
+        """
+        now = now or datetime.now()
+        first_day = (now - timedelta(days=days - 1)).date()
+        start_ts = int(datetime.combine(first_day, datetime.min.time()).timestamp())
+        points = self.read_range(openid, start_ts, int(now.timestamp()), include_previous=True)
+        if len(points) < 2:
+            return []
+
+        consumption = {first_day + timedelta(days=i): 0.0 for i in range(days)}
+        for (_, prev_balance), (ts, balance) in zip(points, points[1:]):
+            day = datetime.fromtimestamp(ts).date()
+            if day in consumption and balance < prev_balance:
+                consumption[day] += prev_balance - balance
+        return sorted(consumption.items())
+
+    def burn_rate(self, openid, days=3, now=None, min_span_hours=6):
+        """根据最近days天的记录估计每天的用电金额（充值不计入）
+
+        Returns:
+            float: 元/天，记录覆盖的时间不足min_span_hours小时时返回None
+        """
+        now_ts = int((now or datetime.now()).timestamp())
+        points = self.read_range(openid, now_ts - days * 86400, now_ts, include_previous=True)
+        if len(points) < 2:
+            return None
+        span = points[-1][0] - points[0][0]
+        if span < min_span_hours * 3600:
+            return None
+        consumed = sum(
+            prev_balance - balance
+            for (_, prev_balance), (_, balance) in zip(points, points[1:])
+            if balance < prev_balance
+        )
+        return consumed / (span / 86400)
+
+    def _downsample(self, records, now_ts):
+        """按记录的新旧程度降采样，每个时间桶只保留最后一条"""
+        hourly_before = now_ts - self.hourly_after_days * 86400
+        daily_before = now_ts - self.daily_after_days * 86400
+        drop_before = now_ts - self.retention_days * 86400
+
+        kept = []
+        last_bucket = None
+        for ts, cents in records:
+            if ts < drop_before:
+                continue
+            if ts < daily_before:
+                bucket = ("d", ts // 86400)
+            elif ts < hourly_before:
+                bucket = ("h", ts // 3600)
+            else:
+                bucket = None
+            if bucket is not None and bucket == last_bucket:
+                kept[-1] = (ts, cents)
+            else:
+                kept.append((ts, cents))
+            last_bucket = bucket
+        return kept
+
+    def compact(self, openid, now=None):
+        """压缩单个openID的历史记录，返回删除的记录数"""
+        now_ts = int((now or datetime.now()).timestamp())
+        path = self._path(openid)
+        return self._compact_file(path, now_ts)
+
+    def _compact_file(self, path, now_ts):
+        with self._lock:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return 0
+            data = data[: len(data) - len(data) % RECORD.size]
+            records = list(RECORD.iter_unpack(data))
+            kept = self._downsample(records, now_ts)
+            if len(kept) == len(records):
+                return 0
+            fd, tmp_path = tempfile.mkstemp(dir=self.history_dir, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(b"".join(RECORD.pack(ts, cents) for ts, cents in kept))
+                os.replace(tmp_path, path)
+            except Exception:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+        return len(records) - len(kept)
+
+    def compact_all(self, now=None):
+        """压缩所有历史记录文件，返回删除的记录总数"""
+        now_ts = int((now or datetime.now()).timestamp())
+        removed = 0
+        for filename in os.listdir(self.history_dir):
+            if not filename.endswith(".bin"):
+                continue
+            try:
+                removed += self._compact_file(os.path.join(self.history_dir, filename), now_ts)
+            except Exception as e:
+                logging.error(f"压缩余额历史记录 {filename} 时出错: {e}")
+        return removed
+
+    async def record(self, openid, balance):
+        """在线程中追加一条记录，出错时只记录日志"""
+        try:
+            await asyncio.to_thread(self.append, openid, balance)
+        except Exception as e:
+            logging.error(f"记录openID {openid} 的余额历史时出错: {e}")
+
+
+_history = None
+
+
+def get_history():
+    """获取进程内共享的余额历史记录"""
+    global _history
+    if _history is None:
+        _history = BalanceHistory(os.path.join(DATA_DIR, "history"))
+    return _history
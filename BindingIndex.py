@@ -0,0 +1,101 @@
+"""
+跨群绑定索引
+维护 openID -> {(group_id, user_id)} 和 user_id -> openID 两个反向索引，
+启动时一次遍历全部绑定建立，之后随绑定/解绑增量更新；
+重建时在线程中建立新索引后整体替换，不阻塞事件循环
+"""
+
+
+class BindingIndex:
+    def __init__(self):
+        # {openid: {(group_id, user_id), ...}}
+        self._members = {}
+        # {user_id: {group_id: openid}}，按绑定先后排列，最后一项为最近的绑定
+        self._users = {}
+        self.loaded = False
+        # 重建期间发生的增量更新，重建完成后按顺序重放
+        self._journal = None
+
+    def __len__(self):
+        return len(self._members)
+
+    def begin_rebuild(self):
+        """开始重建，此后的增量更新先记下来，避免被重建时读到的旧数据覆盖"""
+        self._journal = []
+
+    @classmethod
+    def from_bindings(cls, bindings):
+        """用全部绑定建立一个新索引，不涉及共享状态，可在线程中调用
+
+        Args:
+            bindings: 可迭代的 (group_id, user_id, openid)
+        """
+        index = cls()
+        for group_id, user_id, openid in bindings:
+            index._add(str(group_id), str(user_id), openid)
+        index.loaded = True
+        return index
+
+    def finish_rebuild(self, built):
+        """换用from_bindings建立的新索引，并重放重建期间的增量更新"""
+        journal = self._journal or []
+        self._journal = None
+        self._members = built._members
+        self._users = built._users
+        for op, args in journal:
+            op(*args)
+        self.loaded = True
+
+    def abort_rebuild(self):
+        """重建失败时保留原有索引，记下的更新已应用在原有索引上，直接丢弃"""
+        self._journal = None
+
+    def add(self, group_id, user_id, openid):
+        if self._journal is not None:
+            self._journal.append((self._add, (group_id, user_id, openid)))
+        self._add(group_id, user_id, openid)
+
+    def remove(self, group_id, user_id):
+        if self._journal is not None:
+            self._journal.append((self._remove, (group_id, user_id)))
+        self._remove(group_id, user_id)
+
+    def _add(self, group_id, user_id, openid):
+        if not openid:
+            return
+        self._remove(group_id, user_id)
+        self._members.setdefault(openid, set()).add((group_id, user_id))
+        self._users.setdefault(user_id, {})[group_id] = openid
+
+    def _remove(self, group_id, user_id):
+        groups = self._users.get(user_id)
+        if not groups or group_id not in groups:
+            return
+        openid = groups.pop(group_id)
+        if not groups:
+            del self._users[user_id]
+        members = self._members.get(openid)
+        if members is not None:
+            members.discard((group_id, user_id))
+            if not members:
+                del self._members[openid]
+
+    def members(self, openid):
+        """绑定了该openID的所有 (group_id, user_id)"""
+        return set(self._members.get(openid, ()))
+
+    def openid_for_user(self, user_id, group_id=None):
+        """获取用户绑定的openID，优先使用group_id群中的绑定，否则使用最近的绑定"""
+        groups = self._users.get(str(user_id))
+        if not groups:
+            return None
+        if group_id is not None and str(group_id) in groups:
+            return groups[str(group_id)]
+        return next(reversed(groups.values()))
+
+    def targets(self):
+        """按openID去重后的全部绑定 {openid: {(group_id, user_id), ...}}
+
+        只复制外层字典，值是索引内部的集合，调用方只读；跨await使用时集合可能已随绑定变化
+        """
+        return dict(self._members)
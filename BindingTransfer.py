@@ -0,0 +1,264 @@
+"""
+绑定批量导入导出
+导入 CSV/JSON 格式的 (group_id, user_id, 链接或openID)，并发验证openID后按群批量写入；
+导出时逐条写出所有群组的绑定
+
+用法:
+    python BindingTransfer.py import 文件 [--format csv|json] [--concurrency 10] [--no-validate]
+    python BindingTransfer.py export 文件 [--format csv|json]    # 文件为 - 时输出到标准输出
+"""
+
+import os
+import re
+import io
+import sys
+import csv
+import json
+import asyncio
+import logging
+import argparse
+from urllib.parse import urlparse, parse_qs
+
+# 添加项目根目录到sys.path
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.QFNUElectricityQuery.Storage import get_storage
+from app.scripts.QFNUElectricityQuery.DataManager import DataManager
+from app.scripts.QFNUElectricityQuery.QueryResult import QueryResult
+
+# 直接填写openID时允许的字符
+OPENID_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+# CSV表头中可能出现的列名，第一行是表头时跳过
+HEADER_NAMES = {"group_id", "user_id", "群号", "qq", "用户"}
+
+
+# 提取 openID 的函数
+def extract_openid(link):
+    """从链接中提取openID"""
+    try:
+        parsed_url = urlparse(link)
+        # 尝试从查询参数中获取
+        query_params = parse_qs(parsed_url.query)
+        if "openId" in query_params:
+            return query_params["openId"][0]
+        # 尝试从片段标识符中获取（虽然示例中片段标识符也有，但优先用查询参数）
+        fragment_params = parse_qs(parsed_url.fragment)
+        if "openId" in fragment_params:
+            return fragment_params["openId"][0]
+        # 增加正则表达式匹配，作为备用方案
+        match = re.search(r"openId=([^&/#?]+)", link)
+        if match:
+            return match.group(1)
+    except Exception as e:
+        logging.error(f"Error extracting openID from link {link}: {e}")
+    return None
+
+
+def resolve_openid(value):
+    """链接中提取openID，或直接使用填写的openID，都不符合时返回None"""
+    value = value.strip()
+    if "openId=" in value or value.startswith(("http://", "https://")):
+        return extract_openid(value)
+    if OPENID_PATTERN.match(value):
+        return value
+    return None
+
+
+def _guess_format(path):
+    return "json" if path.lower().endswith(".json") else "csv"
+
+
+def parse_rows(text, fmt="csv", default_group_id=None):
+    """解析导入内容
+
+    CSV每行为 group_id,user_id,链接或openID；指定default_group_id时也可以只有 user_id,链接或openID。
+    JSON为数组，元素为 {"group_id", "user_id", "link" 或 "openid"} 或同样顺序的数组。
+
+    Returns:
+        tuple: ([(行号, group_id, user_id, 链接或openID), ...], [(行号, group_id, user_id, 失败原因), ...])
+    """
+    rows = []
+    errors = []
+    if fmt == "json":
+        try:
+            items = json.loads(text)
+        except ValueError as e:
+            return [], [(0, "", "", f"JSON格式错误: {e}")]
+        if not isinstance(items, list):
+            return [], [(0, "", "", "JSON内容应为数组")]
+        records = []
+        for item in items:
+            if isinstance(item, dict):
+                records.append(
+                    [
+                        item.get("group_id", default_group_id),
+                        item.get("user_id"),
+                        item.get("link") or item.get("openid") or item.get("openId"),
+                    ]
+                )
+            else:
+                records.append(item if isinstance(item, list) else [item])
+    else:
+        records = list(csv.reader(io.StringIO(text)))
+
+    for line, record in enumerate(records, 1):
+        cells = ["" if cell is None else str(cell).strip() for cell in record]
+        if not any(cells):
+            continue
+        if line == 1 and cells[0].lower() in HEADER_NAMES:
+            continue
+        if len(cells) == 2 and default_group_id is not None:
+            cells = [str(default_group_id)] + cells
+        if len(cells) != 3 or not all(cells):
+            errors.append((line, "", "", "格式错误，应为 群号,QQ号,链接或openID"))
+            continue
+        group_id, user_id, value = cells
+        if not group_id.isdigit() or not user_id.isdigit():
+            errors.append((line, group_id, user_id, "群号或QQ号不是数字"))
+            continue
+        rows.append((line, group_id, user_id, value))
+    return rows, errors
+
+
+async def import_bindings(rows, electricity_query=None, concurrency=10):
+    """验证并导入绑定
+
+    Args:
+        rows: parse_rows返回的行
+        electricity_query: 用于验证openID的ElectricityQuery，为None时不验证
+        concurrency: 同时验证的openID数量上限
+
+    Returns:
+        dict: {"imported": 导入条数, "groups": 涉及的群数, "failures": [(行号, group_id, user_id, 原因), ...]}
+    """
+    failures = []
+    resolved = []  # [(行号, group_id, user_id, openid)]
+    for line, group_id, user_id, value in rows:
+        openid = resolve_openid(value)
+        if openid:
+            resolved.append((line, group_id, user_id, openid))
+        else:
+            failures.append((line, group_id, user_id, "无法提取openID"))
+
+    # 同一openID只验证一次，与其他查询共用连接池和缓存
+    if electricity_query is not None:
+        results = await electricity_query.query_many(
+            {openid for _, _, _, openid in resolved}, concurrency
+        )
+        valid = []
+        for line, group_id, user_id, openid in resolved:
+            result = results[openid]
+            if result.status in (QueryResult.OK, QueryResult.INVALID_BALANCE):
+                valid.append((line, group_id, user_id, openid))
+            elif result.status == QueryResult.NOT_FOUND:
+                failures.append((line, group_id, user_id, "查不到户号信息"))
+            else:
+                failures.append((line, group_id, user_id, f"验证失败: {result.error}"))
+        resolved = valid
+
+    # 每个群一次写入，同一用户出现多次时以最后一行为准
+    by_group = {}
+    for line, group_id, user_id, openid in resolved:
+        by_group.setdefault(group_id, {})[user_id] = (line, openid)
+    imported = 0
+    for group_id, entries in by_group.items():
+        bindings = {user_id: openid for user_id, (_, openid) in entries.items()}
+        if await DataManager(group_id).bind_many(bindings):
+            imported += len(bindings)
+        else:
+            failures.extend(
+                (line, group_id, user_id, "写入失败") for user_id, (line, _) in entries.items()
+            )
+    failures.sort()
+    return {"imported": imported, "groups": len(by_group), "failures": failures}
+
+
+def export_bindings(out, fmt="csv", storage=None):
+    """逐条写出所有群组的绑定，不在内存中汇总
+
+    Returns:
+        int: 导出的绑定数
+    """
+    storage = storage or get_storage()
+    count = 0
+    if fmt == "json":
+        out.write("[")
+        for group_id, user_id, openid in storage.iter_bindings():
+            out.write("," if count else "")
+            out.write("\n    ")
+            out.write(
+                json.dumps(
+                    {"group_id": group_id, "user_id": user_id, "openid": openid},
+                    ensure_ascii=False,
+                )
+            )
+            count += 1
+        out.write("\n]\n")
+    else:
+        writer = csv.writer(out)
+        writer.writerow(["group_id", "user_id", "openid"])
+        for group_id, user_id, openid in storage.iter_bindings():
+            writer.writerow([group_id, user_id, openid])
+            count += 1
+    return count
+
+
+def format_report(report, max_failures=20):
+    """将导入结果整理为文字"""
+    lines = [f"导入完成：{report['imported']} 条绑定，涉及 {report['groups']} 个群"]
+    failures = report["failures"]
+    if failures:
+        lines.append(f"失败 {len(failures)} 条：")
+        for line, group_id, user_id, reason in failures[:max_failures]:
+            lines.append(f"第{line}行 {group_id} {user_id}: {reason}")
+        if len(failures) > max_failures:
+            lines.append(f"……另有 {len(failures) - max_failures} 条未列出")
+    return "\n".join(lines)
+
+
+async def _run_import(args):
+    from app.scripts.QFNUElectricityQuery.ElectricityQuery import ElectricityQuery
+
+    with open(args.file, "r", encoding="utf-8-sig") as f:
+        text = f.read()
+    rows, errors = parse_rows(text, args.format or _guess_format(args.file))
+    electricity_query = None if args.no_validate else ElectricityQuery()
+    try:
+        report = await import_bindings(rows, electricity_query, args.concurrency)
+    finally:
+        await ElectricityQuery.close_session()
+    report["failures"] = sorted(errors + report["failures"])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QFNUElectricityQuery 绑定批量导入导出")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="从CSV/JSON导入绑定")
+    import_parser.add_argument("file", help="导入文件")
+    import_parser.add_argument("--format", choices=["csv", "json"], help="文件格式，默认按扩展名判断")
+    import_parser.add_argument("--concurrency", type=int, default=10, help="同时验证的openID数量")
+    import_parser.add_argument("--no-validate", action="store_true", help="不请求接口验证openID")
+    export_parser = subparsers.add_parser("export", help="导出所有绑定")
+    export_parser.add_argument("file", help="导出文件，- 表示标准输出")
+    export_parser.add_argument("--format", choices=["csv", "json"], help="文件格式，默认按扩展名判断")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        report = asyncio.run(_run_import(args))
+        print(format_report(report, max_failures=len(report["failures"])))
+        return
+
+    fmt = args.format or _guess_format(args.file)
+    if args.file == "-":
+        count = export_bindings(sys.stdout, fmt)
+    else:
+        with open(args.file, "w", encoding="utf-8", newline="") as f:
+            count = export_bindings(f, fmt)
+    print(f"导出完成：{count} 条绑定", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,129 +1,327 @@
 """
 数据管理模块
+所有读写都在有界线程池中执行，不会阻塞事件循环
 """
 
 import os
-import json
+import sys
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+# 添加项目根目录到sys.path
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.QFNUElectricityQuery.Storage import DATA_DIR, get_storage, file_lock
+from app.scripts.QFNUElectricityQuery.Metrics import metrics
+from app.scripts.QFNUElectricityQuery.BindingIndex import BindingIndex
+
+# 执行存储读写的线程池，线程数可通过环境变量 QFNUEQ_IO_WORKERS 调整
+_io_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("QFNUEQ_IO_WORKERS", "4")),
+    thread_name_prefix="QFNUElectricityQuery-io",
+)
+
+# 每个群组一把写锁 {group_id: asyncio.Lock}，避免同群并发写入互相覆盖
+_group_locks = {}
+
+# 跨进程文件锁所在目录
+LOCK_DIR = os.path.join(DATA_DIR, "locks")
+
+# 进程内共享的跨群绑定索引，首次使用时建立，之后随绑定/解绑增量更新
+_index = BindingIndex()
+_index_lock = asyncio.Lock()
+
+
+async def _run_io(op, func, *args):
+    """在线程池中执行同步的存储调用，op为记录耗时用的操作名"""
+    loop = asyncio.get_running_loop()
+    with metrics.timer("qfnueq_storage_seconds", op=op):
+        return await loop.run_in_executor(_io_executor, func, *args)
+
+
+async def _rebuild_index():
+    """重建跨群索引，调用方需持有 _index_lock"""
+    _index.begin_rebuild()
+    try:
+        storage = get_storage()
+        built = await _run_io(
+            "rebuild_index", lambda: BindingIndex.from_bindings(storage.iter_bindings())
+        )
+    except Exception as e:
+        _index.abort_rebuild()
+        logging.error(f"重建跨群绑定索引时出错: {e}")
+        return
+    _index.finish_rebuild(built)
+
 
 class DataManager:
+    # 数据目录，可通过环境变量 QFNUEQ_DATA_DIR 覆盖
+    DATA_DIR = DATA_DIR
+
     def __init__(self, group_id):
         self.group_id = str(group_id)  # 确保group_id是字符串
-        self.DATA_DIR = os.path.join(
-            os.path.dirname(
-                os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            ),
-            "data",
-            "QFNUElectricityQuery",
-        )
-        # 确保数据目录存在
-        os.makedirs(self.DATA_DIR, exist_ok=True)
-        self.GROUP_DATA_PATH = os.path.join(self.DATA_DIR, f"{self.group_id}.json")
+        # 存储后端由 QFNUEQ_STORAGE 决定，进程内共享
+        self.storage = get_storage()
+
+    @property
+    def _lock(self):
+        lock = _group_locks.get(self.group_id)
+        if lock is None:
+            lock = _group_locks[self.group_id] = asyncio.Lock()
+        return lock
+
+    @staticmethod
+    async def all_bindings():
+        """获取所有群组的绑定关系
 
-    def _load_group_data(self):
-        """加载群组数据文件，如果文件不存在或为空则返回空字典"""
+        Returns:
+            list: [(group_id, user_id, openid), ...]
+        """
         try:
-            if os.path.exists(self.GROUP_DATA_PATH):
-                with open(self.GROUP_DATA_PATH, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    if not content:
-                        return {}
-                    return json.loads(content)
-            else:
-                return {}
-        except json.JSONDecodeError:
-            logging.error(f"Failed to decode JSON from {self.GROUP_DATA_PATH}")
-            return {}  # 或者可以抛出异常，取决于错误处理策略
+            storage = get_storage()
+            return await _run_io("all_bindings", lambda: list(storage.iter_bindings()))
         except Exception as e:
-            logging.error(f"Error loading group data {self.GROUP_DATA_PATH}: {e}")
-            return {}  # 或者抛出异常
+            logging.error(f"获取所有群组绑定关系时出错: {e}")
+            return []
+
+    @staticmethod
+    async def get_index():
+        """获取跨群绑定索引，尚未建立时先建立"""
+        if not _index.loaded:
+            async with _index_lock:
+                if not _index.loaded:
+                    await _rebuild_index()
+        return _index
+
+    @staticmethod
+    async def rebuild_index():
+        """一次遍历全部绑定重建跨群索引，读取失败时保留原有索引
 
-    def _save_group_data(self, data):
-        """保存群组数据到文件"""
+        Returns:
+            BindingIndex: 重建后的索引
+        """
+        async with _index_lock:
+            await _rebuild_index()
+        return _index
+
+    @staticmethod
+    async def all_last_alert_times():
+        """获取所有群组的上次提醒时间
+
+        Returns:
+            dict: {group_id: {user_id: datetime}}
+        """
         try:
-            with open(self.GROUP_DATA_PATH, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            all_alert_times = await _run_io("all_alert_times", get_storage().get_all_alert_times)
         except Exception as e:
-            logging.error(f"Error saving group data {self.GROUP_DATA_PATH}: {e}")
+            logging.error(f"加载所有群组提醒时间时出错: {e}")
+            return {}
+        return {
+            group_id: _deserialize_alert_times(alert_times)
+            for group_id, alert_times in all_alert_times.items()
+        }
 
-    def bind_openid(self, user_id, openid):
+    async def bind_openid(self, user_id, openid):
         """绑定用户ID和openID"""
         user_id = str(user_id)  # 确保证user_id是字符串
-        data = self._load_group_data()
-        if "bindings" not in data:
-            data["bindings"] = {}
-        data["bindings"][user_id] = openid
-        self._save_group_data(data)
-        return True
-
-    def get_openid(self, user_id):
+        try:
+            async with self._lock:
+                await _run_io("bind", self.storage.set_binding, self.group_id, user_id, openid)
+                _index.add(self.group_id, user_id, openid)
+            return True
+        except Exception as e:
+            logging.error(f"保存群组 {self.group_id} 的绑定关系时出错: {e}")
+            return False
+
+    async def bind_many(self, bindings):
+        """批量绑定本群用户，所有绑定在一次存储写入中完成
+
+        Args:
+            bindings: {user_id: openid}
+        """
+        bindings = {str(user_id): openid for user_id, openid in bindings.items()}
+        try:
+            async with self._lock:
+                await _run_io("bind_many", self.storage.set_bindings, self.group_id, bindings)
+                for user_id, openid in bindings.items():
+                    _index.add(self.group_id, user_id, openid)
+            return True
+        except Exception as e:
+            logging.error(f"批量保存群组 {self.group_id} 的绑定关系时出错: {e}")
+            return False
+
+    async def get_openid(self, user_id):
         """根据用户ID获取openID"""
         user_id = str(user_id)  # 确保证user_id是字符串
-        data = self._load_group_data()
-        return data.get("bindings", {}).get(user_id)
+        return (await self.get_all_bindings()).get(user_id)
+
+    async def find_openid(self, user_id):
+        """获取用户的openID，本群未绑定时使用该用户在其他群的绑定"""
+        openid = await self.get_openid(user_id)
+        if openid:
+            return openid
+        index = await self.get_index()
+        return index.openid_for_user(user_id, self.group_id)
 
-    def unbind_openid(self, user_id):
+    async def unbind_openid(self, user_id):
         """解除用户ID的openID绑定"""
         user_id = str(user_id)  # 确保证user_id是字符串
-        data = self._load_group_data()
-        if "bindings" in data and user_id in data["bindings"]:
-            del data["bindings"][user_id]
-            self._save_group_data(data)
-            return True
-        return False
+        try:
+            async with self._lock:
+                removed = await _run_io(
+                    "unbind", self.storage.delete_binding, self.group_id, user_id
+                )
+                _index.remove(self.group_id, user_id)
+                return removed
+        except Exception as e:
+            logging.error(f"删除群组 {self.group_id} 的绑定关系时出错: {e}")
+            return False
 
-    def get_all_bindings(self):
+    async def get_all_bindings(self):
         """获取所有用户的绑定关系"""
         try:
-            if os.path.exists(self.GROUP_DATA_PATH):
-                with open(self.GROUP_DATA_PATH, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    return data.get("bindings", {})
-            return {}
+            return await _run_io("get_bindings", self.storage.get_bindings, self.group_id)
         except Exception as e:
             logging.error(f"获取绑定关系时出错: {e}")
             return {}
 
-    def save_last_alert_time(self, last_alert_time_dict):
-        """保存上次提醒时间到本地文件
+    async def save_last_alert_time(self, last_alert_time_dict):
+        """覆盖保存上次提醒时间
 
         Args:
             last_alert_time_dict: {user_id: datetime}
         """
-        data = self._load_group_data()
-        if "last_alert_time" not in data:
-            data["last_alert_time"] = {}
+        try:
+            async with self._lock:
+                await _run_io(
+                    "save_alert_times",
+                    self.storage.set_alert_times,
+                    self.group_id,
+                    _serialize_alert_times(last_alert_time_dict),
+                )
+            return True
+        except Exception as e:
+            logging.error(f"保存群组 {self.group_id} 的提醒时间时出错: {e}")
+            return False
 
-        # 将datetime对象转为ISO格式字符串后保存
-        serialized_dict = {}
-        for user_id, timestamp in last_alert_time_dict.items():
-            if isinstance(timestamp, datetime):
-                serialized_dict[user_id] = timestamp.isoformat()
-            else:
-                serialized_dict[user_id] = timestamp
+    async def update_last_alert_time(self, last_alert_time_dict):
+        """合并保存部分用户的上次提醒时间，其他用户的记录保持不变
 
-        data["last_alert_time"] = serialized_dict
-        self._save_group_data(data)
-        return True
+        Args:
+            last_alert_time_dict: {user_id: datetime}
+        """
+        try:
+            async with self._lock:
+                await _run_io(
+                    "update_alert_times",
+                    self.storage.update_alert_times,
+                    self.group_id,
+                    _serialize_alert_times(last_alert_time_dict),
+                )
+            return True
+        except Exception as e:
+            logging.error(f"保存群组 {self.group_id} 的提醒时间时出错: {e}")
+            return False
 
-    def load_last_alert_time(self):
-        """从本地文件加载上次提醒时间
+    async def claim_alerts(self, user_ids, now, interval):
+        """跨进程认领提醒：返回interval内没有被任何进程提醒过的用户，并立即记录提醒时间
+
+        读取和写入在同一把文件锁内完成，多个进程同时巡检同一群时每个用户只会被提醒一次
+
+        Args:
+            user_ids: 待提醒的用户ID列表
+            now: 本次提醒时间（datetime）
+            interval: 两次提醒的最小间隔（timedelta）
+        """
+
+        def claim():
+            os.makedirs(LOCK_DIR, exist_ok=True)
+            with file_lock(os.path.join(LOCK_DIR, f"alert-{self.group_id}.lock")):
+                last = _deserialize_alert_times(self.storage.get_alert_times(self.group_id))
+                claimed = [
+                    user_id
+                    for user_id in user_ids
+                    if user_id not in last or now - last[user_id] > interval
+                ]
+                if claimed:
+                    self.storage.update_alert_times(
+                        self.group_id,
+                        _serialize_alert_times({user_id: now for user_id in claimed}),
+                    )
+                return claimed
+
+        try:
+            async with self._lock:
+                return await _run_io("claim_alerts", claim)
+        except Exception as e:
+            logging.error(f"认领群组 {self.group_id} 的提醒时出错: {e}")
+            return []
+
+    async def release_alerts(self, user_ids, claimed_at):
+        """撤销claim_alerts的认领（提醒未能发出时调用），其他进程之后可以重新提醒
+
+        只删除仍等于claimed_at的记录，不影响之后被其他进程重新认领的用户
+        """
+        claimed_at = _serialize_alert_times({"": claimed_at})[""]
+
+        def release():
+            os.makedirs(LOCK_DIR, exist_ok=True)
+            with file_lock(os.path.join(LOCK_DIR, f"alert-{self.group_id}.lock")):
+                alert_times = dict(self.storage.get_alert_times(self.group_id))
+                released = [
+                    user_id for user_id in user_ids if alert_times.get(user_id) == claimed_at
+                ]
+                if released:
+                    for user_id in released:
+                        del alert_times[user_id]
+                    self.storage.set_alert_times(self.group_id, alert_times)
+                return released
+
+        try:
+            async with self._lock:
+                return await _run_io("release_alerts", release)
+        except Exception as e:
+            logging.error(f"撤销群组 {self.group_id} 的提醒认领时出错: {e}")
+            return []
+
+    async def load_last_alert_time(self):
+        """加载上次提醒时间
 
         Returns:
             dict: {user_id: datetime}
         """
-        data = self._load_group_data()
-        last_alert_time_dict = data.get("last_alert_time", {})
-
-        # 将字符串转回datetime对象
-        result = {}
-        for user_id, timestamp_str in last_alert_time_dict.items():
-            try:
-                result[user_id] = datetime.fromisoformat(timestamp_str)
-            except (TypeError, ValueError):
-                # 如果转换失败，则跳过该记录
-                logging.warning(f"无法解析时间戳: {timestamp_str}")
-
-        return result
+        try:
+            last_alert_time_dict = await _run_io(
+                "load_alert_times", self.storage.get_alert_times, self.group_id
+            )
+        except Exception as e:
+            logging.error(f"加载群组 {self.group_id} 的提醒时间时出错: {e}")
+            return {}
+        return _deserialize_alert_times(last_alert_time_dict)
+
+
+def _serialize_alert_times(last_alert_time_dict):
+    """将datetime对象转为ISO格式字符串"""
+    serialized_dict = {}
+    for user_id, timestamp in last_alert_time_dict.items():
+        if isinstance(timestamp, datetime):
+            serialized_dict[user_id] = timestamp.isoformat()
+        else:
+            serialized_dict[user_id] = timestamp
+    return serialized_dict
+
+
+def _deserialize_alert_times(last_alert_time_dict):
+    """将ISO格式字符串转回datetime对象"""
+    result = {}
+    for user_id, timestamp_str in last_alert_time_dict.items():
+        try:
+            result[user_id] = datetime.fromisoformat(timestamp_str)
+        except (TypeError, ValueError):
+            # 如果转换失败，则跳过该记录
+            logging.warning(f"无法解析时间戳: {timestamp_str}")
+    return result
@@ -2,76 +2,307 @@ import aiohttp  # 使用 aiohttp
 import asyncio
 import json  # 导入 json
 import os
+import sys
+import time
+import random
 from dotenv import load_dotenv
 import logging
 
+# 添加项目根目录到sys.path
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.QFNUElectricityQuery.ResultCache import ResultCache
+from app.scripts.QFNUElectricityQuery.QueryResult import QueryResult
+from app.scripts.QFNUElectricityQuery.BalanceHistory import get_history
+from app.scripts.QFNUElectricityQuery.UpstreamGuard import (
+    TokenBucket,
+    CircuitBreaker,
+    PriorityLimiter,
+    PriorityTicket,
+)
+from app.scripts.QFNUElectricityQuery.Metrics import metrics
+
 load_dotenv()
 
 
 class ElectricityQuery:
     BASE_URL = "http://wechat.sdkdch.cn/wx/api/user/get"
 
+    # 连接池配置，可通过环境变量覆盖
+    REQUEST_TIMEOUT = float(os.getenv("QFNUEQ_REQUEST_TIMEOUT", "10"))  # 单次请求超时（秒）
+    POOL_LIMIT = int(os.getenv("QFNUEQ_POOL_LIMIT", "100"))  # 连接池总连接数上限
+    POOL_LIMIT_PER_HOST = int(os.getenv("QFNUEQ_POOL_LIMIT_PER_HOST", "20"))  # 单主机连接数上限
+    KEEPALIVE_TIMEOUT = float(os.getenv("QFNUEQ_KEEPALIVE_TIMEOUT", "30"))  # 空闲连接保活时间（秒）
+    DNS_CACHE_TTL = int(os.getenv("QFNUEQ_DNS_CACHE_TTL", "300"))  # DNS缓存时间（秒）
+
+    # 查询结果缓存配置
+    CACHE_TTL = float(os.getenv("QFNUEQ_CACHE_TTL", "300"))  # 正常结果缓存时间（秒）
+    CACHE_ERROR_TTL = float(os.getenv("QFNUEQ_CACHE_ERROR_TTL", "30"))  # 接口错误结果缓存时间（秒）
+    CACHE_MAX_SIZE = int(os.getenv("QFNUEQ_CACHE_MAX_SIZE", "1024"))  # 最多缓存的openID数
+
+    # 限流、熔断与重试配置
+    RATE_LIMIT_QPS = float(os.getenv("QFNUEQ_RATE_LIMIT_QPS", "20"))  # 每秒最多发出的请求数，<=0不限流
+    RATE_LIMIT_BURST = int(os.getenv("QFNUEQ_RATE_LIMIT_BURST", "40"))  # 允许的突发请求数
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv("QFNUEQ_BREAKER_FAILURES", "5"))  # 连续失败多少次后熔断
+    BREAKER_RECOVERY_TIMEOUT = float(os.getenv("QFNUEQ_BREAKER_RECOVERY", "30"))  # 熔断后多久开始探测（秒）
+    RETRY_ATTEMPTS = int(os.getenv("QFNUEQ_RETRY_ATTEMPTS", "2"))  # 失败后最多重试次数
+    RETRY_BASE_DELAY = float(os.getenv("QFNUEQ_RETRY_BASE_DELAY", "0.2"))  # 首次重试的退避上限（秒）
+    RETRY_MAX_DELAY = float(os.getenv("QFNUEQ_RETRY_MAX_DELAY", "2"))  # 单次退避上限（秒）
+    RETRY_BUDGET = float(os.getenv("QFNUEQ_RETRY_BUDGET", "15"))  # 含重试在内单次查询的总耗时上限（秒）
+    UPSTREAM_CONCURRENCY = int(os.getenv("QFNUEQ_UPSTREAM_CONCURRENCY", "20"))  # 同时进行的上游请求数上限
+    INTERACTIVE_RESERVED = int(os.getenv("QFNUEQ_INTERACTIVE_RESERVED", "4"))  # 只留给交互查询的并发名额
+
+    # 请求优先级
+    INTERACTIVE = PriorityLimiter.INTERACTIVE  # 用户发起的查询
+    BACKGROUND = PriorityLimiter.BACKGROUND  # 后台巡检、批量报告
+
+    # 进程内共享的会话，所有实例共用同一个连接池
+    _session = None
+    _session_loop = None
+
+    # 进程内共享的查询结果缓存 {openID: QueryResult}
+    _cache = ResultCache(CACHE_MAX_SIZE)
+
+    # 进程内共享的限流器和熔断器
+    _rate_limiter = TokenBucket(RATE_LIMIT_QPS, RATE_LIMIT_BURST)
+    _breaker = CircuitBreaker(
+        BREAKER_FAILURE_THRESHOLD, BREAKER_RECOVERY_TIMEOUT, name="电费接口"
+    )
+    # 进程内共享的上游并发名额，交互查询优先
+    _upstream = PriorityLimiter(UPSTREAM_CONCURRENCY, INTERACTIVE_RESERVED)
+    # 正在加载中的查询的优先级 {openID: PriorityTicket}，交互查询合并进来时提升
+    _loading = {}
+
     # def __init__(self, openID):
     #     self.openID = openID
 
-    async def _get_data(self, url):
-        """执行异步的GET请求"""
-        timeout = aiohttp.ClientTimeout(total=10)  # 设置超时对象
-        try:
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(url) as response:  # timeout移到session创建时
-                    response.raise_for_status()  # 检查HTTP错误
-                    # 确保使用正确的编码读取响应体
-                    return await response.json(encoding="utf-8")
-        except aiohttp.ClientError as e:
-            logging.error(f"Error fetching data from {url}: {e}")
-            return {"code": 500, "msg": f"请求API失败: {e}"}  # 返回统一错误格式
-        except asyncio.TimeoutError:
-            logging.error(f"Timeout error fetching data from {url}")
-            return {"code": 504, "msg": "请求API超时"}
-        except json.JSONDecodeError:
-            logging.error(f"Failed to decode JSON response from {url}")
-            return {"code": 500, "msg": "API响应格式错误"}
-
-    async def get_query(self, openID):
+    @classmethod
+    def get_session(cls):
+        """获取共享的ClientSession，不存在、已关闭或事件循环已变化时重新创建"""
+        loop = asyncio.get_running_loop()
+        if (
+            cls._session is None
+            or cls._session.closed
+            or cls._session_loop is not loop
+        ):
+            connector = aiohttp.TCPConnector(
+                limit=cls.POOL_LIMIT,
+                limit_per_host=cls.POOL_LIMIT_PER_HOST,
+                keepalive_timeout=cls.KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=cls.DNS_CACHE_TTL,
+            )
+            cls._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=cls.REQUEST_TIMEOUT),
+            )
+            cls._session_loop = loop
+        return cls._session
+
+    @classmethod
+    async def close_session(cls):
+        """关闭共享的ClientSession，释放连接池中的所有连接"""
+        session = cls._session
+        cls._session = None
+        cls._session_loop = None
+        if session is not None and not session.closed:
+            await session.close()
+
+    async def _fetch_json(self, url, timeout=None):
+        """发出一次GET请求并解析JSON，timeout为本次请求的超时（秒），默认REQUEST_TIMEOUT"""
+        session = self.get_session()
+        kwargs = {} if timeout is None else {"timeout": aiohttp.ClientTimeout(total=timeout)}
+        async with session.get(url, **kwargs) as response:
+            response.raise_for_status()  # 检查HTTP错误
+            # 确保使用正确的编码读取响应体
+            return await response.json(encoding="utf-8")
+
+    def _retry_delay(self, attempt):
+        """第attempt次重试前的等待时间（带完全抖动的指数退避）"""
+        return random.uniform(0, min(self.RETRY_MAX_DELAY, self.RETRY_BASE_DELAY * 2**attempt))
+
+    async def _get_data(self, url, priority=INTERACTIVE):
+        """执行异步的GET请求
+
+        每次请求先按priority取得并发名额，再经过令牌桶限流；熔断器打开时直接返回504错误；
+        超时、连接错误和5xx会在重试预算内带抖动地指数退避重试；每次请求的超时不超过剩余预算，
+        交互查询超时后不再重试，总耗时不超过一次请求的超时。
+        priority 可以是 PriorityTicket，请求期间被提升后按新的优先级排队和重试
+        """
+        ticket = priority if isinstance(priority, PriorityTicket) else PriorityTicket(priority)
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            # 先按优先级取得并发名额，交互查询不会排在后台巡检之后
+            await self._upstream.acquire(ticket)
+            try:
+                if not self._breaker.allow_request():
+                    metrics.inc("qfnueq_upstream_requests_total", result="circuit_open")
+                    logging.warning(f"电费接口熔断中，跳过请求 {url}")
+                    return {"code": 504, "msg": "电费接口暂时不可用，请稍后再试", "reason": "circuit_open"}
+
+                await self._rate_limiter.acquire()
+                # 排队等待名额和令牌的时间也计入预算
+                remaining = self.RETRY_BUDGET - (time.monotonic() - started)
+                if remaining <= 0:
+                    metrics.inc("qfnueq_upstream_requests_total", result="timeout")
+                    logging.error(f"请求 {url} 超出重试预算")
+                    return {"code": 504, "msg": "请求API超时", "reason": "timeout"}
+                try:
+                    with metrics.timer("qfnueq_upstream_request_seconds"):
+                        data = await self._fetch_json(url, min(self.REQUEST_TIMEOUT, remaining))
+                    self._breaker.record_success()
+                    metrics.inc("qfnueq_upstream_requests_total", result="ok")
+                    return data
+                except aiohttp.ClientResponseError as e:
+                    if e.status < 500:
+                        # 4xx说明接口本身可用，不计入熔断也不重试
+                        self._breaker.record_success()
+                        metrics.inc("qfnueq_upstream_requests_total", result="http_4xx")
+                        logging.error(f"Error fetching data from {url}: {e}")
+                        return {"code": 500, "msg": f"请求API失败: {e}", "reason": "http_error"}
+                    self._breaker.record_failure()
+                    metrics.inc("qfnueq_upstream_requests_total", result="http_5xx")
+                    error = {"code": 500, "msg": f"请求API失败: {e}", "reason": "http_error"}
+                    logging.error(f"Error fetching data from {url}: {e}")
+                except aiohttp.ClientError as e:
+                    self._breaker.record_failure()
+                    metrics.inc("qfnueq_upstream_requests_total", result="error")
+                    error = {"code": 500, "msg": f"请求API失败: {e}", "reason": "http_error"}  # 返回统一错误格式
+                    logging.error(f"Error fetching data from {url}: {e}")
+                except asyncio.TimeoutError:
+                    self._breaker.record_failure()
+                    metrics.inc("qfnueq_upstream_requests_total", result="timeout")
+                    error = {"code": 504, "msg": "请求API超时", "reason": "timeout"}
+                    logging.error(f"Timeout error fetching data from {url}")
+                    if ticket.priority == self.INTERACTIVE:
+                        # 交互查询已等待了一次完整的超时，重试会让用户等待翻倍
+                        return error
+                except json.JSONDecodeError:
+                    self._breaker.record_failure()
+                    metrics.inc("qfnueq_upstream_requests_total", result="bad_json")
+                    logging.error(f"Failed to decode JSON response from {url}")
+                    return {"code": 500, "msg": "API响应格式错误", "reason": "bad_json"}
+            finally:
+                self._upstream.release()
+
+            # 超出重试次数或重试预算时返回最后一次的错误
+            delay = self._retry_delay(attempt)
+            attempt += 1
+            if (
+                attempt > self.RETRY_ATTEMPTS
+                or time.monotonic() - started + delay > self.RETRY_BUDGET
+            ):
+                return error
+            await asyncio.sleep(delay)
+
+    async def get_query(self, openID, priority=INTERACTIVE):
         """根据openID获取原始查询结果"""
         if not openID:
             return {"code": 400, "msg": "openID不能为空"}
         url = f"{self.BASE_URL}?openId={openID}"
-        return await self._get_data(url)
+        return await self._get_data(url, priority)
 
-    async def parse_result(self, openID):
-        """根据openID查询并解析结果，返回格式化的信息或错误信息"""
-        result = await self.get_query(openID)
+    @classmethod
+    def _cache_ttl(cls, result):
+        """根据查询结果决定缓存时间，接口错误使用较短的缓存时间"""
+        if result.status == QueryResult.BAD_REQUEST:
+            return 0
+        if result.reason == QueryResult.CIRCUIT_OPEN:
+            # 熔断与openID无关，不缓存，接口恢复后立即可以查询
+            return 0
+        if result.status == QueryResult.ERROR:
+            return cls.CACHE_ERROR_TTL
+        return cls.CACHE_TTL
 
-        if result.get("code") != 200:
-            # 如果code不是200，直接返回包含错误码和消息的字典
-            return {
-                "code": result.get("code", 500),
-                "message": result.get("msg", "查询失败，未知错误"),
-            }
+    async def query(self, openID, priority=INTERACTIVE):
+        """根据openID查询电费，返回QueryResult
+
+        结果按openID缓存，同一openID的并发查询共享一次接口请求；
+        后台巡检等批量查询应使用 priority=BACKGROUND。交互查询合并到进行中的后台查询时，
+        该查询提升为交互优先级，不会因合并而排在其他后台请求之后
+        """
+        if not openID:
+            return await self._query(openID, priority)
+        loading = ElectricityQuery._loading.get(openID)
+        if loading is not None:
+            loading.promote(priority)
+
+        def start():
+            ticket = ElectricityQuery._loading[openID] = PriorityTicket(priority)
+            return self._load(openID, ticket)
+
+        return await self._cache.get_or_load(openID, start, self._cache_ttl)
+
+    async def _load(self, openID, ticket):
+        try:
+            return await self._query(openID, ticket)
+        finally:
+            if ElectricityQuery._loading.get(openID) is ticket:
+                del ElectricityQuery._loading[openID]
+
+    async def query_many(self, openIDs, concurrency, priority=BACKGROUND):
+        """在并发上限内查询多个openID，返回 {openID: QueryResult}
+
+        与单次查询共用连接池、缓存、限流与熔断，默认以后台优先级查询
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(openID):
+            async with semaphore:
+                try:
+                    return openID, await self.query(openID, priority)
+                except Exception as e:
+                    logging.error(f"查询openID {openID} 时出错: {e}")
+                    return openID, QueryResult(
+                        QueryResult.ERROR, 500, error=str(e), reason="http_error"
+                    )
+
+        return dict(await asyncio.gather(*(one(openID) for openID in set(openIDs))))
+
+    async def _query(self, openID, priority):
+        """请求接口并解析结果"""
+        result = await self.get_query(openID, priority)
+
+        code = result.get("code", 500)
+        if code != 200:
+            status = QueryResult.BAD_REQUEST if code == 400 else QueryResult.ERROR
+            return QueryResult(
+                status, code, error=result.get("msg"), reason=result.get("reason")
+            )
 
         if result.get("total", 0) == 0 or not result.get("rows"):
-            return {
-                "code": 404,
-                "message": "未找到电费信息，可能是你未绑定新校区宿舍户号信息，相关信息在物业提供的表格里",
-            }  # 使用不同的code表示未找到
+            return QueryResult(QueryResult.NOT_FOUND, 404)
 
         user_info = result["rows"][0]
-        # 格式化输出，确保余额只保留两位小数
         try:
             balance = float(user_info.get("balance", "0"))
-            formatted_balance = f"{balance:.2f}"
         except (ValueError, TypeError):
-            formatted_balance = "无效值"
-
-        message = (
-            f"查询成功！\n"
-            # f"用户编号: {user_info.get('userNumber', '无')}\n"
-            # f"用户名: {user_info.get('userName', '无')}\n"
-            f"余额: {formatted_balance}\n"
-            # f"地址: {user_info.get('address', '无')}\n"
-            # f"客户名称: {user_info.get('customerName', '无')}"
-        )
-
-        return {"code": 200, "message": message}
+            return QueryResult(QueryResult.INVALID_BALANCE, 200, fields=user_info)
+
+        # 记录余额历史，用于统计用电情况
+        await get_history().record(openID, balance)
+        return QueryResult(QueryResult.OK, 200, balance=balance, fields=user_info)
+
+
+def _collect_query_metrics():
+    """导出查询缓存和熔断器的状态"""
+    cache = ElectricityQuery._cache
+    return {
+        "qfnueq_cache_hits": cache.hits,
+        "qfnueq_cache_misses": cache.misses,
+        "qfnueq_cache_coalesced": cache.coalesced,
+        "qfnueq_cache_size": len(cache),
+        "qfnueq_circuit_open": int(ElectricityQuery._breaker.state != CircuitBreaker.CLOSED),
+        "qfnueq_upstream_active": ElectricityQuery._upstream.active,
+        "qfnueq_upstream_waiting_interactive": ElectricityQuery._upstream.waiting(
+            PriorityLimiter.INTERACTIVE
+        ),
+        "qfnueq_upstream_waiting_background": ElectricityQuery._upstream.waiting(
+            PriorityLimiter.BACKGROUND
+        ),
+    }
+
+
+metrics.register_collector(_collect_query_metrics)
@@ -0,0 +1,144 @@
+"""
+查询失败隔离
+记录每个openID的连续失败，按指数退避推迟下一次巡检；连续多次查不到户号时标记为失效
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+
+# 添加项目根目录到sys.path
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.QFNUElectricityQuery.QueryResult import QueryResult
+from app.scripts.QFNUElectricityQuery.ShardLease import merge_json_locked
+
+
+class FailureTracker:
+    # 失败类型
+    NOT_FOUND = "not_found"  # 查不到户号信息
+    INVALID_BALANCE = "invalid_balance"  # 余额无法解析
+    HTTP_ERROR = "http_error"  # 连接失败、HTTP错误或响应无法解析
+    TIMEOUT = "timeout"  # 请求超时
+
+    def __init__(self, path, base_backoff, max_backoff, stale_after):
+        # 状态文件路径，为空时不保存
+        self.path = path
+        # 第一次失败后的等待时间（秒），之后每次失败翻倍，不超过max_backoff
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        # 连续多少次查不到户号后标记为失效
+        self.stale_after = stale_after
+        # {openid: {"kind", "count", "since", "next_attempt", "stale", "notified"}}
+        self.entries = {}
+        self.loaded = False
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def classify(cls, result):
+        """将查询结果归类为失败类型，成功返回None；熔断等与openID无关的失败返回False"""
+        if result.status == QueryResult.OK:
+            return None
+        if result.status == QueryResult.NOT_FOUND:
+            return cls.NOT_FOUND
+        if result.status == QueryResult.INVALID_BALANCE:
+            return cls.INVALID_BALANCE
+        if result.reason == QueryResult.TIMEOUT:
+            return cls.TIMEOUT
+        if result.reason in (QueryResult.HTTP_ERROR, QueryResult.BAD_JSON):
+            return cls.HTTP_ERROR
+        return False
+
+    def record(self, openid, result, now=None):
+        """记录一次查询结果
+
+        Returns:
+            bool: 本次是否刚被标记为失效（需要通知用户）
+        """
+        kind = self.classify(result)
+        if kind is None:
+            if self.entries.pop(openid, None) is not None:
+                self._dirty = True
+                logging.info(f"openID {openid} 查询恢复正常，解除隔离")
+            return False
+        if kind is False:
+            return False
+
+        now = time.time() if now is None else now
+        entry = self.entries.get(openid)
+        if entry is None or entry["kind"] != kind:
+            # 失败类型变化时重新计数
+            entry = self.entries[openid] = {
+                "kind": kind,
+                "count": 0,
+                "since": now,
+                "stale": False,
+                "notified": False,
+            }
+        entry["count"] += 1
+        backoff = min(self.max_backoff, self.base_backoff * 2 ** (entry["count"] - 1))
+        entry["next_attempt"] = now + backoff
+        self._dirty = True
+
+        if kind == self.NOT_FOUND and not entry["stale"] and entry["count"] >= self.stale_after:
+            entry["stale"] = True
+            logging.warning(f"openID {openid} 连续 {entry['count']} 次查不到户号信息，标记为失效")
+            return True
+        return False
+
+    def next_attempt(self, openid):
+        """openID下一次允许巡检的时间，未被隔离时返回None"""
+        entry = self.entries.get(openid)
+        return entry["next_attempt"] if entry else None
+
+    def mark_notified(self, openid):
+        entry = self.entries.get(openid)
+        if entry is not None and not entry["notified"]:
+            entry["notified"] = True
+            self._dirty = True
+
+    def forget(self, openids):
+        """删除已不再有绑定的openID"""
+        for openid in list(self.entries):
+            if openid not in openids:
+                del self.entries[openid]
+                self._dirty = True
+
+    def stale_count(self):
+        return sum(1 for entry in self.entries.values() if entry["stale"])
+
+    def load(self):
+        """从文件加载隔离状态，文件不存在或损坏时从空状态开始"""
+        self.loaded = True
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f).get("entries", {})
+        except (OSError, ValueError, AttributeError) as e:
+            logging.error(f"读取隔离状态 {self.path} 时出错: {e}")
+
+    def mark_dirty(self):
+        """保存失败时调用，下次再尝试保存"""
+        self._dirty = True
+
+    def snapshot(self):
+        """有未保存的修改时返回待写入的数据，否则返回None"""
+        if not self._dirty or not self.path:
+            return None
+        self._dirty = False
+        return {"entries": {k: dict(v) for k, v in self.entries.items()}}
+
+    def save(self, snapshot, owned=None):
+        """写入snapshot()返回的数据，可在线程中调用
+
+        owned为本进程负责的openID集合，分片巡检时只替换这部分，为None时整体覆盖
+        """
+        merge_json_locked(self.path, "entries", snapshot["entries"], owned)
@@ -0,0 +1,95 @@
+"""
+群消息发送队列
+每个群组一个队列，同一群按固定间隔发送，不同群之间互不等待
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+
+
+class GroupMessageQueue:
+    def __init__(self, send_func, interval):
+        # 实际发送消息的协程函数 send_func(websocket, group_id, message)
+        self.send_func = send_func
+        # 同一群两条消息之间的最小间隔（秒），避免触发风控
+        self.interval = interval
+        # 每个群的待发送消息 {group_id: deque[(websocket, message, on_done)]}
+        self._queues = {}
+        # 每个群正在运行的发送任务 {group_id: Task}
+        self._workers = {}
+        # 每个群上一次发送的时间 {group_id: monotonic}
+        self._last_sent = {}
+        # 关闭时被中断发送的消息数
+        self._interrupted = 0
+
+    def pending(self):
+        """尚未发送的消息总数"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def put(self, websocket, group_id, message, on_done=None):
+        """加入发送队列，立即返回
+
+        on_done(sent): 发送完成后调用，sent表示是否发送成功；发送失败或关闭时被丢弃也会调用
+        """
+        self._queues.setdefault(group_id, deque()).append((websocket, message, on_done))
+        worker = self._workers.get(group_id)
+        if worker is None or worker.done():
+            self._workers[group_id] = asyncio.create_task(self._drain(group_id))
+
+    async def _drain(self, group_id):
+        queue = self._queues[group_id]
+        while queue:
+            wait = self._last_sent.get(group_id, float("-inf")) + self.interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            websocket, message, on_done = queue.popleft()
+            try:
+                await self.send_func(websocket, group_id, message)
+                sent = True
+            except asyncio.CancelledError:
+                # 关闭时正在发送的消息无法确认是否送达，按未发送处理
+                self._interrupted += 1
+                if on_done is not None:
+                    on_done(False)
+                raise
+            except Exception as e:
+                logging.error(f"向群 {group_id} 发送消息时出错: {e}")
+                sent = False
+            self._last_sent[group_id] = time.monotonic()
+            if on_done is not None:
+                on_done(sent)
+        self._queues.pop(group_id, None)
+        self._workers.pop(group_id, None)
+
+    async def join(self, timeout=None):
+        """等待当前所有队列发送完毕，超过timeout秒时返回False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._workers:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            await asyncio.wait(list(self._workers.values()), timeout=remaining)
+        return True
+
+    async def close(self):
+        """取消所有发送任务并丢弃未发送的消息，被丢弃的消息以 on_done(False) 通知
+
+        Returns:
+            int: 丢弃的消息数
+        """
+        workers = list(self._workers.values())
+        self._interrupted = 0
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        dropped = self._interrupted
+        for queue in self._queues.values():
+            for _, _, on_done in queue:
+                dropped += 1
+                if on_done is not None:
+                    on_done(False)
+        self._workers.clear()
+        self._queues.clear()
+        return dropped
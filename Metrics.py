@@ -0,0 +1,216 @@
+"""
+运行指标
+进程内的计数器、仪表和延迟直方图，可导出为Prometheus文本格式
+"""
+
+import os
+import sys
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+
+# 添加项目根目录到sys.path
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.QFNUElectricityQuery.Storage import DATA_DIR
+
+# 延迟直方图的桶上限（秒）
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """按桶估计分位数，返回所在桶的上限"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "labels", "start")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(key, extra=None):
+    items = list(key)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Metrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        # {name: {label_key: value}}
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        # 导出时调用的回调，返回 {gauge名: 值}，用于采集其他模块自带的计数
+        self._collectors = []
+        self._last_export = None
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        series = self.counters.setdefault(name, {})
+        key = _label_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+        self.gauges.setdefault(name, {})[_label_key(labels)] = value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        series = self.histograms.setdefault(name, {})
+        key = _label_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = _Histogram()
+        histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """计时上下文管理器，退出时把耗时记入直方图"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+
+    def collect(self):
+        """调用所有回调，刷新由其他模块提供的仪表值"""
+        for collector in self._collectors:
+            try:
+                for name, value in collector().items():
+                    self.set_gauge(name, value)
+            except Exception as e:
+                logging.error(f"采集运行指标时出错: {e}")
+
+    def counter_value(self, name, **labels):
+        return self.counters.get(name, {}).get(_label_key(labels), 0)
+
+    def counter_total(self, name):
+        return sum(self.counters.get(name, {}).values())
+
+    def gauge_value(self, name, default=None, **labels):
+        return self.gauges.get(name, {}).get(_label_key(labels), default)
+
+    def histogram(self, name, **labels):
+        return self.histograms.get(name, {}).get(_label_key(labels))
+
+    def render_prometheus(self):
+        """导出为Prometheus文本格式"""
+        self.collect()
+        lines = []
+        for name, series in sorted(self.counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(self.gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in series.items():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{_format_labels(key, ('le', bound))} {cumulative}"
+                    )
+                lines.append(
+                    f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {histogram.count}"
+                )
+                lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """原子地写入Prometheus文本文件，供node_exporter的textfile采集器读取"""
+        _write_text(path, self.render_prometheus())
+
+    async def maybe_export(self, path, interval):
+        """距上次导出超过interval秒时，在线程中导出一次"""
+        if not self.enabled or not path:
+            return
+        now = time.monotonic()
+        if self._last_export is not None and now - self._last_export < interval:
+            return
+        self._last_export = now
+        try:
+            # 渲染在事件循环中完成，避免与指标更新并发；只把写文件放到线程中
+            content = self.render_prometheus()
+            await asyncio.to_thread(_write_text, path, content)
+        except Exception as e:
+            logging.error(f"导出运行指标到 {path} 时出错: {e}")
+
+
+def _write_text(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+# 进程内共享的指标，QFNUEQ_METRICS=0 时关闭
+metrics = Metrics(enabled=os.getenv("QFNUEQ_METRICS", "1") != "0")
+# 指标文件路径及导出间隔（秒），路径为空时不导出
+METRICS_FILE = os.getenv(
+    "QFNUEQ_METRICS_FILE", os.path.join(DATA_DIR, "QFNUElectricityQuery.prom")
+)
+METRICS_EXPORT_INTERVAL = float(os.getenv("QFNUEQ_METRICS_EXPORT_INTERVAL", "60"))
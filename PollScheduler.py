@@ -0,0 +1,131 @@
+"""
+自适应巡检调度
+根据每个openID的耗电速度预测余额何时接近阈值，据此安排下一次检查时间；
+每个openID在巡检窗口内有固定的时刻，检查均匀分散在整个窗口中
+"""
+
+import heapq
+import hashlib
+
+
+class PollScheduler:
+    def __init__(self, threshold, min_interval, max_interval, safety_factor=0.5, window=0):
+        # 提醒阈值（元）
+        self.threshold = threshold
+        # 两次检查之间的最短/最长间隔（秒）
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # 只等待预计到达阈值时间的一部分，给耗电速度的波动留余量
+        self.safety_factor = safety_factor
+        # 巡检窗口（秒），>0 时每个openID只在窗口内固定的时刻被检查，0表示不分散
+        self.window = window
+        # 按下次检查时间排序的小顶堆 [(due_ts, openid)]，过期条目惰性删除
+        self._heap = []
+        # 每个openID当前有效的下次检查时间 {openid: due_ts}
+        self._due = {}
+
+    def __len__(self):
+        return len(self._due)
+
+    def next_due(self, openid):
+        """返回openID的下次检查时间，未安排时返回None"""
+        return self._due.get(openid)
+
+    def slot_for(self, openid):
+        """openID在巡检窗口内的固定偏移（秒），由openID的哈希决定，重启后不变"""
+        digest = hashlib.blake2b(openid.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") / 2**64 * self.window
+
+    def next_slot(self, openid, ts):
+        """openID在ts之后（含ts）的第一个检查时刻；未设置窗口时返回ts"""
+        if self.window <= 0:
+            return ts
+        slot = self.slot_for(openid)
+        cycles = -((slot - ts) // self.window)  # 向上取整
+        return slot + cycles * self.window
+
+    def _push(self, openid, due_ts):
+        self._due[openid] = due_ts
+        heapq.heappush(self._heap, (due_ts, openid))
+
+    def pop_due(self, openids, now):
+        """从openids中取出已到检查时间的openID
+
+        未设置窗口时从未检查过的openID视为已到期；设置了窗口时安排到它的下一个检查时刻
+
+        Args:
+            openids: 当前仍有绑定的openID集合
+            now: 当前Unix时间戳
+
+        Returns:
+            list: 需要检查的openID
+        """
+        due = []
+        for openid in openids:
+            if openid not in self._due:
+                due_ts = self.next_slot(openid, now)
+                if due_ts <= now:
+                    due.append(openid)
+                else:
+                    self._push(openid, due_ts)
+        while self._heap and self._heap[0][0] <= now:
+            due_ts, openid = heapq.heappop(self._heap)
+            if self._due.get(openid) != due_ts:
+                continue  # 已被重新安排的旧条目
+            del self._due[openid]
+            if openid in openids:
+                due.append(openid)
+        return due
+
+    def interval_for(self, balance, rate_per_day):
+        """计算距下一次检查的间隔（秒）
+
+        Args:
+            balance: 最新余额，查询失败时为None
+            rate_per_day: 每天耗电金额，无法估计时为None
+        """
+        if balance is None or balance < self.threshold:
+            # 查询失败或已低于阈值时按最短间隔继续检查
+            return self.min_interval
+        if rate_per_day is None:
+            # 记录不足、无法估计耗电速度（如新绑定的openID）时按最短间隔检查，直到积累足够记录
+            return self.min_interval
+        if rate_per_day <= 0:
+            # 足够长的记录中没有耗电，才按最长间隔检查
+            return self.max_interval
+        seconds_to_threshold = (balance - self.threshold) / rate_per_day * 86400
+        interval = seconds_to_threshold * self.safety_factor
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def schedule(self, openid, balance, rate_per_day, now, not_before=None):
+        """根据本次检查结果安排openID的下次检查时间，返回下次检查的时间戳
+
+        not_before: 最早的检查时间（如查询失败后的退避结束时间）
+        """
+        due_ts = now + self.interval_for(balance, rate_per_day)
+        if self.window > 0:
+            # 取离预定时间最近的检查时刻，避免因检查略晚于时刻而推迟一整个窗口
+            due_ts = self.next_slot(openid, due_ts - self.window / 2)
+        if not_before is not None and due_ts < not_before:
+            due_ts = self.next_slot(openid, not_before)
+        self._push(openid, due_ts)
+        return due_ts
+
+    def state(self):
+        """导出所有openID的下次检查时间 {openid: due_ts}，用于保存检查点"""
+        return dict(self._due)
+
+    def restore(self, due, now, catch_up=0):
+        """从检查点恢复下次检查时间
+
+        逾期不超过catch_up秒的openID保持原时间，在下一轮立即检查；
+        逾期更久（如停机较长时间）的安排到各自的下一个检查时刻，避免重启后集中检查
+
+        Returns:
+            int: 恢复的openID数
+        """
+        for openid, due_ts in due.items():
+            if due_ts < now - catch_up:
+                due_ts = self.next_slot(openid, now)
+            self._push(openid, due_ts)
+        return len(due)
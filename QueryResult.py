@@ -0,0 +1,50 @@
+"""
+电费查询结果
+只保存数值和接口原始字段，展示用的文字由调用方按需生成
+"""
+
+import time
+
+
+class QueryResult:
+    # 查询状态
+    OK = "ok"  # 查询成功，balance为余额
+    NOT_FOUND = "not_found"  # 接口没有该openID的户号信息
+    INVALID_BALANCE = "invalid_balance"  # 查到了户号，但余额无法解析
+    BAD_REQUEST = "bad_request"  # openID为空等参数错误
+    ERROR = "error"  # 接口超时、熔断或返回错误
+
+    # 接口错误的原因，只有status为ERROR时才有值
+    TIMEOUT = "timeout"  # 请求超时
+    HTTP_ERROR = "http_error"  # 连接失败或HTTP错误
+    BAD_JSON = "bad_json"  # 响应无法解析
+    CIRCUIT_OPEN = "circuit_open"  # 熔断中，没有实际发出请求
+
+    __slots__ = ("status", "code", "balance", "fetched_at", "fields", "error", "reason")
+
+    def __init__(
+        self, status, code, balance=None, fields=None, error=None, fetched_at=None, reason=None
+    ):
+        self.status = status
+        # 与旧版字典结果一致的状态码（200/404/400/5xx）
+        self.code = code
+        # 余额（元），只有status为OK时才有值
+        self.balance = balance
+        # 查询完成的时间戳，命中缓存时为首次查询的时间
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        # 接口返回的户号信息（rows[0]），未查到时为空字典
+        self.fields = fields or {}
+        # 接口错误信息，查询成功时为None
+        self.error = error
+        # 接口错误的原因（TIMEOUT/HTTP_ERROR/BAD_JSON/CIRCUIT_OPEN）
+        self.reason = reason
+
+    @property
+    def ok(self):
+        return self.status == self.OK
+
+    def __repr__(self):
+        return (
+            f"QueryResult(status={self.status!r}, code={self.code}, "
+            f"balance={self.balance}, fetched_at={self.fetched_at:.0f})"
+        )
@@ -0,0 +1,87 @@
+"""
+查询结果缓存
+按key缓存结果（TTL + LRU淘汰），并合并同一key的并发加载请求
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    def __init__(self, max_size=1024):
+        # 最多缓存的条目数，超出后淘汰最久未使用的条目
+        self.max_size = max_size
+        # {key: (过期时间, 值)}，按最近使用顺序排列
+        self._data = OrderedDict()
+        # 正在加载中的请求 {key: Task}
+        self._inflight = {}
+        # 命中、未命中、合并到进行中请求的次数
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """获取未过期的缓存值，不存在或已过期时返回None"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expire_at, value = entry
+        if expire_at <= time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl):
+        """写入缓存，ttl<=0 时不缓存"""
+        if ttl <= 0:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """删除指定key的缓存"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    async def get_or_load(self, key, loader, ttl_for):
+        """获取缓存值，未命中时调用loader加载
+
+        同一key的并发调用只会触发一次loader，所有调用方共享同一结果。
+
+        Args:
+            key: 缓存键
+            loader: 无参函数，返回加载值的协程；开始加载时同步调用
+            ttl_for: 根据加载结果返回缓存时间（秒）的函数
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader(), ttl_for))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        # 使用shield，避免某个调用方被取消时连带取消共享的加载任务
+        return await asyncio.shield(task)
+
+    async def _load(self, key, coro, ttl_for):
+        try:
+            value = await coro
+            self.set(key, value, ttl_for(value))
+            return value
+        finally:
+            self._inflight.pop(key, None)
@@ -0,0 +1,176 @@
+"""
+巡检分片租约
+多个机器人进程共用同一数据目录时，按群号哈希把群组分成若干分片，
+每个进程通过文件锁租用一部分分片，租约过期后其他进程可以接管
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import socket
+import hashlib
+import logging
+
+# 添加项目根目录到sys.path
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.QFNUElectricityQuery.Storage import atomic_write_json, file_lock
+
+
+def shard_of(group_id, shard_count):
+    """群号对应的分片，与进程和Python的哈希随机化无关"""
+    digest = hashlib.blake2b(str(group_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        logging.warning(f"文件 {path} 内容无效，视为不存在")
+        return None
+
+
+def merge_json_locked(path, key, entries, owned=None):
+    """在文件锁内合并写入JSON文件的data[key]
+
+    只替换owned中的键（owned为None时整体替换），保留其他进程负责的部分
+
+    Args:
+        path: JSON文件路径
+        key: 要合并的字段名
+        entries: 本进程的最新数据 {键: 值}
+        owned: 本进程负责的键集合
+    """
+    with file_lock(f"{path}.lock"):
+        if owned is None:
+            merged = dict(entries)
+        else:
+            merged = {
+                k: v for k, v in ((_read_json(path) or {}).get(key) or {}).items()
+                if k not in owned
+            }
+            merged.update((k, v) for k, v in entries.items() if k in owned)
+        atomic_write_json(path, {"saved_at": time.time(), key: merged}, compact=True)
+
+
+class ShardLease:
+    def __init__(self, lease_dir, shard_count, ttl, worker_id=None):
+        self.lease_dir = lease_dir
+        self.shard_count = max(1, shard_count)
+        # 租约有效期（秒），需大于续约间隔，进程退出后最多这么久被其他进程接管
+        self.ttl = ttl
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        # 当前持有的分片
+        self.owned = set()
+
+    def _lease_path(self, shard):
+        return os.path.join(self.lease_dir, f"shard-{shard}.lease")
+
+    def _worker_path(self, worker_id):
+        return os.path.join(self.lease_dir, f"worker-{worker_id}.json")
+
+    def _live_workers(self, now):
+        """登记本进程的心跳并返回存活的进程数，顺便清理过期的心跳文件"""
+        atomic_write_json(
+            self._worker_path(self.worker_id),
+            {"worker_id": self.worker_id, "expires_at": now + self.ttl},
+        )
+        live = 0
+        for name in os.listdir(self.lease_dir):
+            if not (name.startswith("worker-") and name.endswith(".json")):
+                continue
+            path = os.path.join(self.lease_dir, name)
+            heartbeat = _read_json(path)
+            if heartbeat and heartbeat.get("expires_at", 0) > now:
+                live += 1
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return max(1, live)
+
+    def _write_lease(self, shard, now):
+        atomic_write_json(
+            self._lease_path(shard),
+            {"owner": self.worker_id, "expires_at": now + self.ttl},
+        )
+
+    def renew(self, now=None):
+        """续约已持有的分片，并按存活进程数均分接管空闲或过期的分片（同步，可在线程中调用）
+
+        Returns:
+            set: 续约后持有的分片
+        """
+        now = time.time() if now is None else now
+        os.makedirs(self.lease_dir, exist_ok=True)
+        target = math.ceil(self.shard_count / self._live_workers(now))
+
+        # 先续约自己的分片，超出份额的释放给新加入的进程；再接管空闲的分片
+        leases = {}
+        owned = set()
+        for shard in range(self.shard_count):
+            with file_lock(f"{self._lease_path(shard)}.lock"):
+                lease = _read_json(self._lease_path(shard))
+                leases[shard] = lease
+                if not lease or lease.get("owner") != self.worker_id:
+                    continue
+                if len(owned) < target and lease.get("expires_at", 0) > now:
+                    self._write_lease(shard, now)
+                    owned.add(shard)
+                else:
+                    self._remove_lease(shard)
+                    leases[shard] = None
+
+        # 从与进程相关的位置开始接管，减少多个进程同时争抢同一分片
+        start = shard_of(self.worker_id, self.shard_count)
+        for i in range(self.shard_count):
+            if len(owned) >= target:
+                break
+            shard = (start + i) % self.shard_count
+            if shard in owned:
+                continue
+            lease = leases[shard]
+            if lease and lease.get("expires_at", 0) > now:
+                continue
+            with file_lock(f"{self._lease_path(shard)}.lock"):
+                # 加锁后重新读取，避免与其他进程同时接管
+                lease = _read_json(self._lease_path(shard))
+                if lease and lease.get("owner") != self.worker_id and lease.get("expires_at", 0) > now:
+                    continue
+                self._write_lease(shard, now)
+                owned.add(shard)
+                if lease and lease.get("owner") != self.worker_id:
+                    logging.info(f"接管了进程 {lease.get('owner')} 过期的巡检分片 {shard}")
+
+        if owned != self.owned:
+            logging.info(f"巡检分片变化: {sorted(self.owned)} -> {sorted(owned)}")
+        self.owned = owned
+        return owned
+
+    def _remove_lease(self, shard):
+        try:
+            os.remove(self._lease_path(shard))
+        except OSError:
+            pass
+
+    def release(self):
+        """释放所有分片和心跳，进程退出前调用（同步）"""
+        for shard in self.owned:
+            with file_lock(f"{self._lease_path(shard)}.lock"):
+                lease = _read_json(self._lease_path(shard))
+                if lease and lease.get("owner") == self.worker_id:
+                    self._remove_lease(shard)
+        self.owned = set()
+        try:
+            os.remove(self._worker_path(self.worker_id))
+        except OSError:
+            pass
@@ -0,0 +1,372 @@
+"""
+存储后端
+提供按群组分文件的JSON存储和SQLite存储，通过环境变量 QFNUEQ_STORAGE 选择
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.request import pathname2url
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有fcntl，只能单进程运行
+    fcntl = None
+
+# 数据目录，可通过环境变量 QFNUEQ_DATA_DIR 覆盖
+DATA_DIR = os.getenv("QFNUEQ_DATA_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "data",
+    "QFNUElectricityQuery",
+)
+
+
+def atomic_write_json(path, data, compact=False):
+    """先写入同目录下的临时文件再重命名，保证文件不会处于写了一半的状态
+
+    compact为True时不缩进，使用C编码器，适合程序读写的大文件
+    """
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    if compact:
+        content = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    else:
+        content = json.dumps(data, ensure_ascii=False, indent=4)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def file_lock(path):
+    """进程间互斥锁（flock），退出时释放；没有fcntl时不加锁"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a+") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class JsonStorage:
+    """每个群组一个 <group_id>.json 文件，提醒时间单独存放在 alert_state/<group_id>.json"""
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.alert_dir = os.path.join(self.data_dir, "alert_state")
+        os.makedirs(self.alert_dir, exist_ok=True)
+        # 修改绑定时的文件锁目录，机器人与命令行工具等多个进程同时写同一群时不会互相覆盖
+        self.lock_dir = os.path.join(self.data_dir, "locks")
+        os.makedirs(self.lock_dir, exist_ok=True)
+        # 已解析的群组数据缓存 {group_id: (mtime_ns, size, data)}
+        # 文件的修改时间或大小变化时自动失效，外部修改仍能被读到
+        self._cache = {}
+
+    def _group_path(self, group_id):
+        return os.path.join(self.data_dir, f"{group_id}.json")
+
+    def _alert_path(self, group_id):
+        return os.path.join(self.alert_dir, f"{group_id}.json")
+
+    def _binding_lock(self, group_id):
+        """群组数据文件的读-改-写在该锁内完成"""
+        return file_lock(os.path.join(self.lock_dir, f"bindings-{group_id}.lock"))
+
+    def _load(self, group_id):
+        """加载群组数据文件，如果文件不存在或为空则返回空字典
+
+        返回的字典是缓存中的共享对象，只读调用方不应修改它
+        """
+        path = self._group_path(group_id)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self._cache.pop(group_id, None)
+            return {}
+        except Exception as e:
+            logging.error(f"Error loading group data {path}: {e}")
+            return {}
+
+        cached = self._cache.get(group_id)
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return cached[2]
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            data = json.loads(content) if content else {}
+        except json.JSONDecodeError:
+            logging.error(f"Failed to decode JSON from {path}")
+            return {}
+        except Exception as e:
+            logging.error(f"Error loading group data {path}: {e}")
+            return {}
+        self._cache[group_id] = (stat.st_mtime_ns, stat.st_size, data)
+        return data
+
+    def _save(self, group_id, data):
+        """原子地保存群组数据到文件，并同步更新缓存"""
+        path = self._group_path(group_id)
+        try:
+            atomic_write_json(path, data)
+            stat = os.stat(path)
+            self._cache[group_id] = (stat.st_mtime_ns, stat.st_size, data)
+        except Exception:
+            # 写入失败时丢弃缓存，下次从磁盘重新读取
+            self._cache.pop(group_id, None)
+            raise
+
+    def list_groups(self):
+        """列出所有有数据文件的群组"""
+        return [
+            filename[:-5]
+            for filename in os.listdir(self.data_dir)
+            if filename.endswith(".json") and filename[:-5].isdigit()
+        ]
+
+    def get_bindings(self, group_id):
+        return self._load(group_id).get("bindings", {})
+
+    def set_binding(self, group_id, user_id, openid):
+        self.set_bindings(group_id, {user_id: openid})
+
+    def set_bindings(self, group_id, new_bindings):
+        """批量写入一个群的绑定 {user_id: openid}，只写一次文件"""
+        with self._binding_lock(group_id):
+            # 写时复制，缓存中的字典可能正被其他线程读取
+            data = dict(self._load(group_id))
+            bindings = dict(data.get("bindings", {}))
+            bindings.update(new_bindings)
+            data["bindings"] = bindings
+            self._save(group_id, data)
+
+    def delete_binding(self, group_id, user_id):
+        with self._binding_lock(group_id):
+            data = dict(self._load(group_id))
+            bindings = dict(data.get("bindings", {}))
+            if user_id not in bindings:
+                return False
+            del bindings[user_id]
+            data["bindings"] = bindings
+            self._save(group_id, data)
+            return True
+
+    def iter_bindings(self):
+        """遍历所有群组的绑定关系，产出 (group_id, user_id, openid)"""
+        for group_id in self.list_groups():
+            for user_id, openid in self.get_bindings(group_id).items():
+                yield group_id, user_id, openid
+
+    def get_alert_times(self, group_id):
+        path = self._alert_path(group_id)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # 兼容旧版本写在群组文件中的提醒时间
+            return self._load(group_id).get("last_alert_time", {})
+        except Exception as e:
+            logging.error(f"Error loading alert state {path}: {e}")
+            return {}
+
+    def set_alert_times(self, group_id, alert_times):
+        """覆盖保存群组的提醒时间，不会重写绑定关系文件"""
+        atomic_write_json(self._alert_path(group_id), alert_times)
+
+    def update_alert_times(self, group_id, alert_times):
+        """合并保存部分用户的提醒时间"""
+        merged = dict(self.get_alert_times(group_id))
+        merged.update(alert_times)
+        self.set_alert_times(group_id, merged)
+
+    def get_all_alert_times(self):
+        """获取所有群组的提醒时间 {group_id: {user_id: iso时间字符串}}"""
+        group_ids = set(self.list_groups())
+        group_ids.update(
+            filename[:-5]
+            for filename in os.listdir(self.alert_dir)
+            if filename.endswith(".json") and filename[:-5].isdigit()
+        )
+        result = {}
+        for group_id in group_ids:
+            alert_times = self.get_alert_times(group_id)
+            if alert_times:
+                result[group_id] = alert_times
+        return result
+
+    def close(self):
+        pass
+
+
+class SqliteStorage:
+    """所有群组共用一个SQLite数据库（WAL模式）"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # 主键 (group_id, user_id) 同时作为 group_id 的索引
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS bindings (
+                group_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                openid TEXT NOT NULL,
+                PRIMARY KEY (group_id, user_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_bindings_user_id ON bindings (user_id);
+            CREATE INDEX IF NOT EXISTS idx_bindings_openid ON bindings (openid);
+            CREATE TABLE IF NOT EXISTS alert_times (
+                group_id TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                last_alert_time TEXT NOT NULL,
+                PRIMARY KEY (group_id, user_id)
+            );
+            """
+        )
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def list_groups(self):
+        rows = self._query(
+            "SELECT group_id FROM bindings UNION SELECT group_id FROM alert_times"
+        )
+        return [row[0] for row in rows]
+
+    def get_bindings(self, group_id):
+        rows = self._query(
+            "SELECT user_id, openid FROM bindings WHERE group_id = ?", (group_id,)
+        )
+        return dict(rows)
+
+    def set_binding(self, group_id, user_id, openid):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO bindings (group_id, user_id, openid) VALUES (?, ?, ?)",
+                (group_id, user_id, openid),
+            )
+
+    def set_bindings(self, group_id, new_bindings):
+        """批量写入一个群的绑定 {user_id: openid}，在同一个事务中完成"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO bindings (group_id, user_id, openid) VALUES (?, ?, ?)",
+                [(group_id, user_id, openid) for user_id, openid in new_bindings.items()],
+            )
+
+    def delete_binding(self, group_id, user_id):
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM bindings WHERE group_id = ? AND user_id = ?",
+                (group_id, user_id),
+            )
+        return cursor.rowcount > 0
+
+    def iter_bindings(self, batch_size=1000):
+        """遍历所有群组的绑定关系，产出 (group_id, user_id, openid)
+
+        使用单独的只读连接分批读取，不把全部记录读入内存，也不长时间占用写连接的锁
+        """
+        conn = sqlite3.connect(
+            f"file:{pathname2url(self.path)}?mode=ro", uri=True, check_same_thread=False
+        )
+        try:
+            cursor = conn.execute("SELECT group_id, user_id, openid FROM bindings")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def get_alert_times(self, group_id):
+        rows = self._query(
+            "SELECT user_id, last_alert_time FROM alert_times WHERE group_id = ?",
+            (group_id,),
+        )
+        return dict(rows)
+
+    def set_alert_times(self, group_id, alert_times):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM alert_times WHERE group_id = ?", (group_id,))
+            self._conn.executemany(
+                "INSERT INTO alert_times (group_id, user_id, last_alert_time) VALUES (?, ?, ?)",
+                [(group_id, user_id, ts) for user_id, ts in alert_times.items()],
+            )
+
+    def update_alert_times(self, group_id, alert_times):
+        """合并保存部分用户的提醒时间"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO alert_times (group_id, user_id, last_alert_time) VALUES (?, ?, ?)",
+                [(group_id, user_id, ts) for user_id, ts in alert_times.items()],
+            )
+
+    def get_all_alert_times(self):
+        """获取所有群组的提醒时间 {group_id: {user_id: iso时间字符串}}"""
+        result = {}
+        for group_id, user_id, ts in self._query(
+            "SELECT group_id, user_id, last_alert_time FROM alert_times"
+        ):
+            result.setdefault(group_id, {})[user_id] = ts
+        return result
+
+    def import_group(self, group_id, bindings, alert_times):
+        """在一个事务内写入一个群组的全部数据，已存在的记录会被覆盖"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO bindings (group_id, user_id, openid) VALUES (?, ?, ?)",
+                [(group_id, user_id, openid) for user_id, openid in bindings.items()],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO alert_times (group_id, user_id, last_alert_time) VALUES (?, ?, ?)",
+                [(group_id, user_id, ts) for user_id, ts in alert_times.items()],
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_storage = None
+
+
+def get_storage():
+    """获取进程内共享的存储后端
+
+    QFNUEQ_STORAGE=json（默认）使用按群组分文件的JSON存储，
+    QFNUEQ_STORAGE=sqlite 使用 QFNUEQ_SQLITE_PATH 指定的数据库
+    """
+    global _storage
+    if _storage is None:
+        backend = os.getenv("QFNUEQ_STORAGE", "json").lower()
+        if backend == "sqlite":
+            path = os.getenv("QFNUEQ_SQLITE_PATH") or os.path.join(
+                DATA_DIR, "QFNUElectricityQuery.db"
+            )
+            _storage = SqliteStorage(path)
+        else:
+            _storage = JsonStorage(DATA_DIR)
+    return _storage
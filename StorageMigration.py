@@ -0,0 +1,58 @@
+"""
+存储迁移工具
+将按群组分文件的JSON数据一次性导入SQLite数据库
+
+用法: python StorageMigration.py [--data-dir 目录] [--db 数据库路径]
+"""
+
+import os
+import sys
+import logging
+import argparse
+
+# 添加项目根目录到sys.path
+sys.path.append(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+from app.scripts.QFNUElectricityQuery.Storage import DATA_DIR, JsonStorage, SqliteStorage
+
+
+def migrate_json_to_sqlite(json_storage, sqlite_storage):
+    """将JSON存储中的所有群组导入SQLite，每个群组一个事务
+
+    Returns:
+        tuple: (导入的群组数, 导入的绑定数)
+    """
+    groups = 0
+    bindings = 0
+    for group_id in json_storage.list_groups():
+        group_bindings = json_storage.get_bindings(group_id)
+        alert_times = json_storage.get_alert_times(group_id)
+        if not group_bindings and not alert_times:
+            continue
+        sqlite_storage.import_group(group_id, group_bindings, alert_times)
+        groups += 1
+        bindings += len(group_bindings)
+    return groups, bindings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将QFNUElectricityQuery的JSON数据迁移到SQLite")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="JSON数据目录")
+    parser.add_argument("--db", default=None, help="SQLite数据库路径，默认为数据目录下的QFNUElectricityQuery.db")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(args.data_dir, "QFNUElectricityQuery.db")
+    sqlite_storage = SqliteStorage(db_path)
+    try:
+        groups, bindings = migrate_json_to_sqlite(JsonStorage(args.data_dir), sqlite_storage)
+    finally:
+        sqlite_storage.close()
+    logging.info(f"迁移完成：{groups} 个群组，{bindings} 条绑定关系 -> {db_path}")
+    print(f"迁移完成：{groups} 个群组，{bindings} 条绑定关系 -> {db_path}")
+    print("设置环境变量 QFNUEQ_STORAGE=sqlite 后重启机器人即可使用SQLite存储")
+
+
+if __name__ == "__main__":
+    main()
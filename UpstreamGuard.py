@@ -0,0 +1,201 @@
+"""
+上游接口保护
+令牌桶限流、熔断器和按优先级分配的并发名额，避免接口变慢或宕机时请求堆积
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+
+
+class TokenBucket:
+    """令牌桶限流，rate为每秒补充的令牌数，burst为桶容量；rate<=0时不限流"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """取一个令牌，不足时等待；令牌允许预支为负数，等待者按到达顺序排队"""
+        if self.rate <= 0:
+            return
+        self._refill()
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class CircuitBreaker:
+    """熔断器
+
+    closed: 正常放行，连续失败达到阈值后转为open
+    open: 直接拒绝，经过recovery_timeout秒后转为half_open
+    half_open: 只放行少量探测请求，成功则恢复closed，失败则重新open
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, recovery_timeout, half_open_max=1, name="upstream"):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max = half_open_max
+        self.name = name
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    def allow_request(self):
+        """判断当前是否允许发出请求"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.recovery_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probes = 0
+            self._opened_at = time.monotonic()
+            logging.info(f"{self.name} 熔断器进入半开状态，开始探测")
+        if self._probes >= self.half_open_max:
+            # 探测请求被取消而没有结果时，超时后允许重新探测
+            if time.monotonic() - self._opened_at < self.recovery_timeout:
+                return False
+            self._probes = 0
+            self._opened_at = time.monotonic()
+        self._probes += 1
+        return True
+
+    def record_success(self):
+        if self.state == self.HALF_OPEN:
+            logging.info(f"{self.name} 探测成功，熔断器关闭")
+        self.state = self.CLOSED
+        self._failures = 0
+        self._probes = 0
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logging.warning(
+                    f"{self.name} 连续失败 {self._failures} 次，熔断 {self.recovery_timeout} 秒"
+                )
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probes = 0
+
+
+class PriorityTicket:
+    """一次请求的优先级，排队期间可以提升（如交互查询合并到了进行中的后台查询上）"""
+
+    def __init__(self, priority):
+        self.priority = priority
+        # 正在排队时为 (limiter, future)
+        self._waiter = None
+
+    def promote(self, priority):
+        """提升到priority（数值越小优先级越高），正在排队时移到对应的等待队列"""
+        if priority >= self.priority:
+            return
+        self.priority = priority
+        if self._waiter is not None:
+            limiter, future = self._waiter
+            limiter._move(future, priority)
+
+
+class PriorityLimiter:
+    """按优先级分配的并发名额
+
+    INTERACTIVE请求总是先于BACKGROUND请求获得名额；另外保留reserved个名额只给
+    INTERACTIVE使用，后台请求最多同时占用 limit - reserved 个名额
+    """
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+    def __init__(self, limit, reserved=0):
+        self.limit = max(1, limit)
+        self.reserved = min(max(0, reserved), self.limit - 1)
+        self.active = 0
+        # 每个优先级一个等待队列，按到达顺序排列
+        self._waiters = (deque(), deque())
+
+    def waiting(self, priority):
+        return len(self._waiters[priority])
+
+    def _can_start(self, priority):
+        if priority == self.INTERACTIVE:
+            return self.active < self.limit
+        return (
+            not self._waiters[self.INTERACTIVE]
+            and self.active < self.limit - self.reserved
+        )
+
+    async def acquire(self, priority):
+        """获取一个名额，没有空闲名额时排队等待
+
+        priority 可以是 PriorityTicket，排队期间可通过它提升优先级
+        """
+        ticket = priority if isinstance(priority, PriorityTicket) else None
+        if ticket is not None:
+            priority = ticket.priority
+        if not self._waiters[priority] and self._can_start(priority):
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(future)
+        if ticket is not None:
+            ticket._waiter = (self, future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已经分到名额但调用方被取消，归还名额
+                self.release()
+            else:
+                # 排队期间可能已被提升到其他队列
+                for waiters in self._waiters:
+                    try:
+                        waiters.remove(future)
+                        break
+                    except ValueError:
+                        pass
+            raise
+        finally:
+            if ticket is not None:
+                ticket._waiter = None
+
+    def _move(self, future, priority):
+        """将排队中的请求移到priority的等待队列"""
+        for waiters in self._waiters:
+            try:
+                waiters.remove(future)
+                break
+            except ValueError:
+                pass
+        else:
+            return
+        self._waiters[priority].append(future)
+        self._wake()
+
+    def release(self):
+        self.active -= 1
+        self._wake()
+
+    def _wake(self):
+        for priority in (self.INTERACTIVE, self.BACKGROUND):
+            waiters = self._waiters[priority]
+            while waiters and self._can_start(priority):
+                future = waiters.popleft()
+                if not future.done():
+                    self.active += 1
+                    future.set_result(None)
@@ -0,0 +1,3 @@
+"""
+QFNUElectricityQuery 离线性能测试
+"""
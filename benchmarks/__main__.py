@@ -0,0 +1,150 @@
+"""
+离线性能测试套件：本地桩接口 + 模拟OneBot连接 + 模拟数据目录
+
+用法: python -m benchmarks [--groups 2000] [--bindings 20] [--latency 0.05] ... [--json 结果文件]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import fake_onebot, synthetic
+from benchmarks.stub_server import StubElectricityServer
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="QFNUElectricityQuery 离线性能测试")
+    parser.add_argument("--groups", type=int, default=2000, help="模拟群组数")
+    parser.add_argument("--bindings", type=int, default=20, help="每群绑定数")
+    parser.add_argument("--shared-ratio", type=float, default=0.2, help="复用已有openID的绑定比例")
+    parser.add_argument("--latency", type=float, default=0.05, help="桩接口基础延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.05, help="桩接口延迟抖动（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="桩接口返回500的概率")
+    parser.add_argument("--not-found-rate", type=float, default=0.05, help="返回 total: 0 的openID比例")
+    parser.add_argument("--invalid-rate", type=float, default=0.01, help="余额无法解析的openID比例")
+    parser.add_argument("--queries", type=int, default=500, help="交互查询延迟采样次数")
+    parser.add_argument("--concurrency", type=int, default=20, help="巡检与查询的并发数")
+    parser.add_argument("--qps", type=float, default=0, help="上游限流QPS，0为不限流")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--json", dest="json_path", help="把结果以JSON追加写入该文件")
+    return parser.parse_args(argv)
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p * len(ordered)) - 1)]
+
+
+async def bench_sweep(manager, server):
+    """完整巡检一次，返回耗时、上游请求数、提醒数和峰值内存"""
+    websocket = fake_onebot.FakeWebSocket()
+    server.reset()
+    # 关闭窗口分散，让所有openID在这一轮内检查，测量一次完整巡检
+    manager.poll_scheduler.window = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    await manager.check_and_alert(websocket)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    alert_messages = manager.message_queue.pending() + len(websocket.actions("send_group_msg"))
+    await manager.message_queue.close()
+    return {
+        "sweep_seconds": elapsed,
+        "sweep_upstream_requests": server.request_count,
+        "sweep_peak_upstream_concurrency": server.peak_in_flight,
+        "sweep_alert_messages": alert_messages,
+        "sweep_peak_memory_mb": peak / 1024 / 1024,
+    }
+
+
+async def bench_queries(query, server, openids, concurrency):
+    """冷缓存下的单次查询延迟"""
+    server.reset()
+    query._cache.clear()
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(openid):
+        async with semaphore:
+            start = time.perf_counter()
+            await query.query(openid)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(openid) for openid in openids))
+    return {
+        "query_count": len(latencies),
+        "query_p50_ms": percentile(latencies, 0.50) * 1000,
+        "query_p99_ms": percentile(latencies, 0.99) * 1000,
+        "query_upstream_requests": server.request_count,
+    }
+
+
+def report(args, bindings, openids, results):
+    print(
+        f"群组={args.groups} 绑定={bindings} 不同openID={len(openids)} "
+        f"接口延迟={args.latency}+{args.jitter}s 错误率={args.error_rate:.0%}"
+    )
+    print(f"巡检耗时          {results['sweep_seconds']:.2f}s")
+    print(f"巡检上游请求数    {results['sweep_upstream_requests']}")
+    print(f"巡检上游并发峰值  {results['sweep_peak_upstream_concurrency']}")
+    print(f"巡检提醒消息数    {results['sweep_alert_messages']}")
+    print(f"巡检峰值内存      {results['sweep_peak_memory_mb']:.1f}MB")
+    print(
+        f"查询延迟          p50={results['query_p50_ms']:.1f}ms "
+        f"p99={results['query_p99_ms']:.1f}ms（{results['query_count']}次，"
+        f"上游请求{results['query_upstream_requests']}次）"
+    )
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as data_dir:
+        # 插件在导入时读取环境变量，必须先设置
+        os.environ["QFNUEQ_DATA_DIR"] = data_dir
+        os.environ["QFNUEQ_RATE_LIMIT_QPS"] = str(args.qps)
+        os.environ["QFNUEQ_SWEEP_CONCURRENCY"] = str(args.concurrency)
+        fake_onebot.install_fake_host()
+        bindings, openids = synthetic.make_data_dir(
+            data_dir, args.groups, args.bindings, args.shared_ratio, args.seed
+        )
+
+        from app.scripts.QFNUElectricityQuery.ElectricityQuery import ElectricityQuery
+        from app.scripts.QFNUElectricityQuery.BalanceAlertManager import BalanceAlertManager
+
+        server = StubElectricityServer(
+            latency=args.latency,
+            latency_jitter=args.jitter,
+            error_rate=args.error_rate,
+            not_found_rate=args.not_found_rate,
+            invalid_balance_rate=args.invalid_rate,
+            seed=args.seed,
+        )
+        ElectricityQuery.BASE_URL = await server.start()
+        try:
+            results = await bench_sweep(BalanceAlertManager(), server)
+            sample = random.Random(args.seed).sample(openids, min(args.queries, len(openids)))
+            results.update(
+                await bench_queries(ElectricityQuery(), server, sample, args.concurrency)
+            )
+        finally:
+            await ElectricityQuery.close_session()
+            await server.stop()
+
+    report(args, bindings, openids, results)
+    if args.json_path:
+        record = {"timestamp": time.time(), "args": vars(args), "results": results}
+        with open(args.json_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,33 @@
+"""
+让性能测试脚本既能在机器人项目内运行，也能在单独检出的插件目录中运行
+"""
+
+import importlib
+import os
+import sys
+import types
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(PLUGIN_DIR)))
+PACKAGE = "app.scripts.QFNUElectricityQuery"
+
+
+def setup():
+    """确保可以通过 app.scripts.QFNUElectricityQuery 导入插件模块"""
+    if PROJECT_ROOT not in sys.path:
+        sys.path.insert(0, PROJECT_ROOT)
+    try:
+        importlib.import_module(PACKAGE)
+        return
+    except ImportError:
+        pass
+
+    # 不在机器人项目中时，把插件目录挂载为 app.scripts.QFNUElectricityQuery
+    for name in ("app", "app.scripts"):
+        if name not in sys.modules:
+            module = types.ModuleType(name)
+            module.__path__ = []
+            sys.modules[name] = module
+    package = types.ModuleType(PACKAGE)
+    package.__path__ = [PLUGIN_DIR]
+    sys.modules[PACKAGE] = package
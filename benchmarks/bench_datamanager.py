@@ -0,0 +1,67 @@
+"""
+对比每次重新解析群组JSON与内存缓存下的绑定查询延迟
+
+用法: python -m benchmarks.bench_datamanager [每群绑定数] [查询次数]
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks import _bootstrap
+
+_bootstrap.setup()
+
+
+def _reparse_get_openid(path, user_id):
+    """旧实现：每次查询都重新打开并解析群组文件"""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    data = json.loads(content) if content else {}
+    return data.get("bindings", {}).get(user_id)
+
+
+async def _measure(label, func, user_ids):
+    start = time.perf_counter()
+    for user_id in user_ids:
+        result = func(user_id)
+        if asyncio.iscoroutine(result):
+            await result
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} 平均每次查询 {elapsed / len(user_ids) * 1e6:.1f}µs")
+    return elapsed
+
+
+async def main(bindings=5000, lookups=2000):
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["QFNUEQ_DATA_DIR"] = data_dir
+        from app.scripts.QFNUElectricityQuery.DataManager import DataManager
+
+        group_id = "100000"
+        user_ids = [str(1000000 + i) for i in range(bindings)]
+        path = os.path.join(data_dir, f"{group_id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"bindings": {uid: f"openid-{uid}" for uid in user_ids}},
+                f,
+                ensure_ascii=False,
+                indent=4,
+            )
+
+        sample = [random.choice(user_ids) for _ in range(lookups)]
+        print(f"群组绑定数={bindings} 查询次数={lookups}")
+        before = await _measure(
+            "重新解析", lambda uid: _reparse_get_openid(path, uid), sample
+        )
+        data_manager = DataManager(group_id)
+        after = await _measure("内存缓存", data_manager.get_openid, sample)
+        print(f"加速比 {before / after:.0f}x")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.run(main(*args))
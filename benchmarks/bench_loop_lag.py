@@ -0,0 +1,97 @@
+"""
+测量读取全部绑定关系时的事件循环延迟：直接在事件循环中读盘 vs 线程池读盘
+
+用法: python -m benchmarks.bench_loop_lag [群组数] [每群绑定数]
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks import _bootstrap
+
+_bootstrap.setup()
+
+
+class LoopLagMonitor:
+    """周期性地sleep，记录实际唤醒时间比预期晚了多少"""
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - start - self.interval)
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def report(self, label):
+        if not self.samples:
+            print(f"{label:<10} 无采样")
+            return
+        worst = max(self.samples) * 1000
+        average = sum(self.samples) / len(self.samples) * 1000
+        print(f"{label:<10} 最大延迟 {worst:.2f}ms 平均延迟 {average:.3f}ms")
+
+
+def _write_groups(data_dir, groups, bindings):
+    for g in range(groups):
+        group_id = str(100000 + g)
+        data = {
+            "bindings": {
+                str(1000000 + g * bindings + i): f"openid-{g}-{i}"
+                for i in range(bindings)
+            }
+        }
+        with open(os.path.join(data_dir, f"{group_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+async def _measure(label, storage, func):
+    storage._cache.clear()
+    monitor = LoopLagMonitor()
+    monitor.start()
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    result = func()
+    if asyncio.iscoroutine(result):
+        result = await result
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0.01)
+    await monitor.stop()
+    monitor.report(label)
+    print(f"{'':<10} 读取 {len(result)} 条绑定，耗时 {elapsed * 1000:.1f}ms")
+
+
+async def main(groups=300, bindings=200):
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["QFNUEQ_DATA_DIR"] = data_dir
+        from app.scripts.QFNUElectricityQuery.DataManager import DataManager
+        from app.scripts.QFNUElectricityQuery.Storage import get_storage
+
+        _write_groups(data_dir, groups, bindings)
+        storage = get_storage()
+        print(f"群组数={groups} 每群绑定数={bindings}")
+        await _measure("同步读盘", storage, lambda: list(storage.iter_bindings()))
+        await _measure("线程池读盘", storage, DataManager.all_bindings)
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.run(main(*args))
@@ -0,0 +1,86 @@
+"""
+巡检进行中时交互查询的延迟：交互查询优先 vs 与巡检同一队列排队
+
+用法: python -m benchmarks.bench_priority [巡检openID数] [交互查询数]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks import _bootstrap
+
+_bootstrap.setup()
+
+# 插件在导入时读取环境变量，必须先设置；关闭限流，只比较并发名额的分配
+os.environ.setdefault("QFNUEQ_DATA_DIR", tempfile.mkdtemp(prefix="qfnueq-bench-"))
+os.environ["QFNUEQ_RATE_LIMIT_QPS"] = "0"
+
+from app.scripts.QFNUElectricityQuery.ElectricityQuery import ElectricityQuery
+from benchmarks.__main__ import percentile
+from benchmarks.stub_server import StubElectricityServer
+
+# 巡检一次性提交的并发数，远大于上游并发名额，模拟大群巡检时的积压
+SWEEP_CONCURRENCY = 200
+# 交互查询的到达间隔（秒）
+ARRIVAL_INTERVAL = 0.02
+
+
+async def _interactive(query, count, priority):
+    """按固定间隔发起count次不同openID的查询，返回每次的耗时"""
+    latencies = []
+
+    async def one(i):
+        start = time.perf_counter()
+        await query.query(f"interactive{i:06d}", priority)
+        latencies.append(time.perf_counter() - start)
+
+    tasks = []
+    for i in range(count):
+        tasks.append(asyncio.create_task(one(i)))
+        await asyncio.sleep(ARRIVAL_INTERVAL)
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+async def _run(label, query, server, sweep_size, count, priority):
+    server.reset()
+    query._cache.clear()
+    sweep = None
+    if sweep_size:
+        openids = [f"sweep{i:06d}" for i in range(sweep_size)]
+        sweep = asyncio.create_task(query.query_many(openids, SWEEP_CONCURRENCY))
+        # 等巡检把上游名额占满后再开始交互查询
+        await asyncio.sleep(0.2)
+    latencies = await _interactive(query, count, priority)
+    if sweep is not None:
+        await sweep
+    print(
+        f"{label:<16} p50={percentile(latencies, 0.50) * 1000:7.1f}ms "
+        f"p99={percentile(latencies, 0.99) * 1000:7.1f}ms "
+        f"上游请求数={server.request_count}"
+    )
+
+
+async def main(sweep_size=3000, count=100):
+    server = StubElectricityServer(latency=0.05, latency_jitter=0.02)
+    ElectricityQuery.BASE_URL = await server.start()
+    query = ElectricityQuery()
+    print(
+        f"上游并发={ElectricityQuery.UPSTREAM_CONCURRENCY} "
+        f"交互保留={ElectricityQuery.INTERACTIVE_RESERVED} 巡检openID数={sweep_size}"
+    )
+    try:
+        await _run("无巡检", query, server, 0, count, ElectricityQuery.INTERACTIVE)
+        await _run("巡检中-交互优先", query, server, sweep_size, count, ElectricityQuery.INTERACTIVE)
+        await _run("巡检中-同一队列", query, server, sweep_size, count, ElectricityQuery.BACKGROUND)
+    finally:
+        await ElectricityQuery.close_session()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.run(main(*args))
@@ -0,0 +1,82 @@
+"""
+回放模拟的群聊消息流，测量 handle_events 每秒能处理的消息数
+
+用法: python -m benchmarks.bench_router [消息数] [命令占比]
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks import fake_onebot
+
+CHAT_LINES = [
+    "哈哈哈哈",
+    "今天食堂的饭好难吃",
+    "有人去图书馆吗",
+    "查一下明天的课表",
+    "电费怎么又没了",
+    "[CQ:image,file=abc.jpg]",
+    "query language 作业写完了吗",
+    "qq群文件在哪",
+    "收到",
+    "@全体成员 明天上午开会",
+    "用电好多啊这个月",
+    "6",
+    "？",
+]
+COMMANDS = ["查询", "查电费", "qfnueqmenu", "电费解绑", "用电记录 7"]
+
+
+def _make_stream(count, command_ratio, groups=20, users=500):
+    stream = []
+    for i in range(count):
+        if random.random() < command_ratio:
+            text = random.choice(COMMANDS)
+        else:
+            text = random.choice(CHAT_LINES)
+            if random.random() < 0.5:
+                text += str(random.randint(0, 9999))
+        stream.append(
+            {
+                "post_type": "message",
+                "message_type": "group",
+                "group_id": 100000 + random.randrange(groups),
+                "user_id": 2000000 + random.randrange(users),
+                "message_id": i,
+                "raw_message": text,
+            }
+        )
+    return stream
+
+
+async def main(count=50000, command_ratio=0.01):
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["QFNUEQ_DATA_DIR"] = data_dir
+        fake_onebot.install_fake_host()
+        from app.scripts.QFNUElectricityQuery import main as plugin
+
+        stream = _make_stream(count, command_ratio)
+        for msg in stream:
+            fake_onebot.save_switch(msg["group_id"], "QFNUElectricityQuery", True)
+        websocket = fake_onebot.FakeWebSocket()
+
+        start = time.perf_counter()
+        for msg in stream:
+            await plugin.handle_events(websocket, msg)
+        elapsed = time.perf_counter() - start
+
+        print(f"消息数={count} 命令占比={command_ratio:.1%}")
+        print(f"耗时 {elapsed * 1000:.1f}ms，吞吐 {count / elapsed:.0f} 条/秒")
+        print(f"发出动作 {len(websocket.sent)} 个")
+        await plugin.shutdown()
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:3]
+    count = int(args[0]) if args else 50000
+    ratio = float(args[1]) if len(args) > 1 else 0.01
+    asyncio.run(main(count, ratio))
@@ -0,0 +1,62 @@
+"""
+对比每次请求新建ClientSession与共享连接池的连接复用情况
+
+用法: python -m benchmarks.bench_session [请求数] [并发数]
+"""
+
+import asyncio
+import sys
+import time
+
+import aiohttp
+
+from benchmarks import _bootstrap
+
+_bootstrap.setup()
+
+from app.scripts.QFNUElectricityQuery.ElectricityQuery import ElectricityQuery
+from benchmarks.stub_server import StubElectricityServer
+
+
+async def _per_request_session(url):
+    """旧实现：每次请求都新建并关闭一个ClientSession"""
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(url) as response:
+            return await response.json(encoding="utf-8")
+
+
+async def _run(label, server, func, requests, concurrency):
+    server.reset()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await func(f"{server.url}?openId=bench{i}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<12} 请求数={server.request_count:<6} "
+        f"TCP连接数={server.connection_count:<6} "
+        f"耗时={elapsed * 1000:.1f}ms 吞吐={requests / elapsed:.0f} req/s"
+    )
+
+
+async def main(requests=500, concurrency=10):
+    server = StubElectricityServer()
+    await server.start()
+    query = ElectricityQuery()
+    try:
+        await _run("每次新建会话", server, _per_request_session, requests, concurrency)
+        # 直接测量请求本身，不经过限流和熔断，否则测到的是令牌桶的速率
+        await _run("共享连接池", server, query._fetch_json, requests, concurrency)
+    finally:
+        await ElectricityQuery.close_session()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:3]]
+    asyncio.run(main(*args))
@@ -0,0 +1,55 @@
+"""
+模拟一天内每轮巡检需要检查的openID数：整点集中巡检 vs 窗口内固定时刻分散巡检
+
+不访问接口，余额和耗电速度随机生成，只统计每轮检查数的峰值和平均值
+
+用法: python -m benchmarks.bench_spread [openID数] [模拟小时数]
+"""
+
+import random
+import sys
+
+from benchmarks import _bootstrap
+
+_bootstrap.setup()
+
+from app.scripts.QFNUElectricityQuery.PollScheduler import PollScheduler
+
+WINDOW = 3600  # 巡检窗口（秒）
+TICK = 60  # 分散巡检时每轮的间隔（秒）
+
+
+def simulate(openids, hours, window, tick, seed=0):
+    """返回每轮检查的openID数"""
+    rng = random.Random(seed)
+    scheduler = PollScheduler(30, WINDOW, 172800, window=window)
+    balances = {openid: rng.uniform(0, 200) for openid in openids}
+    rates = {openid: rng.uniform(1, 10) for openid in openids}
+    targets = set(openids)
+    start = 1_700_000_000
+    counts = []
+    for now in range(start, start + hours * 3600, tick):
+        due = scheduler.pop_due(targets, now)
+        for openid in due:
+            balances[openid] = max(0.0, balances[openid] - rates[openid] / 24)
+            scheduler.schedule(openid, balances[openid], rates[openid], now)
+        counts.append(len(due))
+    return counts
+
+
+def report(label, counts):
+    busy = [c for c in counts if c]
+    print(
+        f"{label:<8} 轮次={len(counts):<5} 检查总数={sum(counts):<7} "
+        f"每轮峰值={max(counts):<6} 有检查的轮次平均={sum(busy) / max(1, len(busy)):.1f}"
+    )
+
+
+def main(count=20000, hours=24):
+    openids = [f"oSpread{i:08d}" for i in range(count)]
+    report("整点集中", simulate(openids, hours, window=0, tick=WINDOW))
+    report("窗口分散", simulate(openids, hours, window=WINDOW, tick=TICK))
+
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,105 @@
+"""
+模拟OneBot连接
+FakeWebSocket记录插件发出的所有动作；不在机器人项目中运行时，
+install_fake_host() 提供最小化的 app.api / app.config / app.switch
+"""
+
+import json
+import sys
+import types
+import itertools
+
+from benchmarks import _bootstrap
+
+
+class FakeWebSocket:
+    def __init__(self):
+        # 插件发出的所有动作 [{"action": ..., "params": ..., "echo": ...}]
+        self.sent = []
+
+    async def send(self, data):
+        self.sent.append(json.loads(data))
+
+    def actions(self, name):
+        return [item for item in self.sent if item.get("action") == name]
+
+    def reset(self):
+        self.sent.clear()
+
+
+# 测试用的功能开关 {(group_id, 功能名): bool}
+switches = {}
+_message_ids = itertools.count(1)
+
+
+async def _send_action(websocket, action, params, echo):
+    await websocket.send(
+        json.dumps({"action": action, "params": params, "echo": echo}, ensure_ascii=False)
+    )
+
+
+async def send_group_msg(websocket, group_id, content):
+    await _send_action(
+        websocket,
+        "send_group_msg",
+        {"group_id": group_id, "message": content},
+        f"send_group_msg_{content}",
+    )
+
+
+async def send_private_msg(websocket, user_id, content):
+    await _send_action(
+        websocket,
+        "send_private_msg",
+        {"user_id": user_id, "message": content},
+        f"send_private_msg_{content}",
+    )
+
+
+async def delete_msg(websocket, message_id):
+    await _send_action(websocket, "delete_msg", {"message_id": message_id}, "delete_msg")
+
+
+def load_switch(group_id, name):
+    return switches.get((str(group_id), name), False)
+
+
+def save_switch(group_id, name, status):
+    switches[(str(group_id), name)] = status
+
+
+def ok_response(request):
+    """为一条send_group_msg动作构造机器人返回的回调事件"""
+    return {
+        "status": "ok",
+        "retcode": 0,
+        "data": {"message_id": next(_message_ids)},
+        "echo": request.get("echo"),
+    }
+
+
+def install_fake_host(owner_ids=("10000",)):
+    """在没有机器人框架时注册最小化的宿主模块，已有真实框架时不做任何事"""
+    _bootstrap.setup()
+    try:
+        import app.api  # noqa: F401
+        import app.config  # noqa: F401
+        import app.switch  # noqa: F401
+        return False
+    except ImportError:
+        pass
+
+    api = types.ModuleType("app.api")
+    api.send_group_msg = send_group_msg
+    api.send_private_msg = send_private_msg
+    api.delete_msg = delete_msg
+    config = types.ModuleType("app.config")
+    config.owner_id = list(owner_ids)
+    config.__all__ = ["owner_id"]
+    switch = types.ModuleType("app.switch")
+    switch.load_switch = load_switch
+    switch.save_switch = save_switch
+    for name, module in (("app.api", api), ("app.config", config), ("app.switch", switch)):
+        sys.modules[name] = module
+        setattr(sys.modules["app"], name.split(".")[1], module)
+    return True
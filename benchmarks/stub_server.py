@@ -0,0 +1,114 @@
+"""
+本地电费接口桩服务，模拟 /wx/api/user/get
+"""
+
+import asyncio
+import random
+import zlib
+
+from aiohttp import web
+
+
+class StubElectricityServer:
+    def __init__(
+        self,
+        latency=0.0,
+        latency_jitter=0.0,
+        error_rate=0.0,
+        not_found_rate=0.0,
+        invalid_balance_rate=0.0,
+        seed=None,
+    ):
+        # 每次请求的模拟延迟（秒）及随机抖动范围
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        # 返回HTTP 500的概率（每次请求独立随机）
+        self.error_rate = error_rate
+        # 返回 total: 0 / 余额无法解析的openID占比（按openID固定）
+        self.not_found_rate = not_found_rate
+        self.invalid_balance_rate = invalid_balance_rate
+        self._random = random.Random(seed)
+        # 已处理的请求数
+        self.request_count = 0
+        # 服务端接受过的TCP连接（按对端地址区分）
+        self.peers = set()
+        # 同时处理中的请求数及其峰值
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._runner = None
+        self.url = None
+
+    @property
+    def connection_count(self):
+        return len(self.peers)
+
+    def reset(self):
+        self.request_count = 0
+        self.peers.clear()
+        self.peak_in_flight = 0
+
+    @staticmethod
+    def _fraction(open_id, salt):
+        """把openID稳定地映射到 [0, 1)，同一openID每次得到相同的响应形态"""
+        return zlib.crc32(f"{salt}:{open_id}".encode("utf-8")) / 2**32
+
+    def balance_for(self, open_id):
+        """openID对应的模拟余额，分布在 0~200 元之间"""
+        return round(self._fraction(open_id, "balance") * 200, 2)
+
+    def payload_for(self, open_id):
+        if self._fraction(open_id, "not_found") < self.not_found_rate:
+            return {"code": 200, "msg": "查询成功", "total": 0, "rows": []}
+        if self._fraction(open_id, "invalid") < self.invalid_balance_rate:
+            balance = "--"
+        else:
+            balance = f"{self.balance_for(open_id):.2f}"
+        return {
+            "code": 200,
+            "msg": "查询成功",
+            "total": 1,
+            "rows": [
+                {
+                    "userNumber": open_id,
+                    "userName": "测试用户",
+                    "balance": balance,
+                    "address": "测试宿舍",
+                    "customerName": "测试",
+                }
+            ],
+        }
+
+    async def _handle_get(self, request):
+        self.request_count += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            peer = request.transport.get_extra_info("peername") if request.transport else None
+            if peer:
+                self.peers.add(peer)
+            delay = self.latency
+            if self.latency_jitter:
+                delay += self._random.uniform(0, self.latency_jitter)
+            if delay:
+                await asyncio.sleep(delay)
+            if self.error_rate and self._random.random() < self.error_rate:
+                return web.json_response({"code": 500, "msg": "服务器错误"}, status=500)
+            return web.json_response(self.payload_for(request.query.get("openId", "")))
+        finally:
+            self.in_flight -= 1
+
+    async def start(self, host="127.0.0.1", port=0):
+        app = web.Application()
+        app.router.add_get("/wx/api/user/get", self._handle_get)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}/wx/api/user/get"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,36 @@
+"""
+生成模拟的群组绑定数据
+"""
+
+import json
+import os
+import random
+
+
+def make_data_dir(data_dir, groups, bindings_per_group, shared_ratio=0.2, seed=0):
+    """在data_dir中写入groups个群组文件，每群bindings_per_group条绑定
+
+    shared_ratio比例的绑定复用其他群已出现的openID，模拟同一宿舍多人、多群绑定
+
+    Returns:
+        tuple: (绑定总数, 所有不同的openID列表)
+    """
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    openids = []
+    total = 0
+    for g in range(groups):
+        group_id = str(100000 + g)
+        bindings = {}
+        for i in range(bindings_per_group):
+            user_id = str(2000000 + g * bindings_per_group + i)
+            if openids and rng.random() < shared_ratio:
+                openid = rng.choice(openids)
+            else:
+                openid = f"oBench{len(openids):08d}"
+                openids.append(openid)
+            bindings[user_id] = openid
+        total += len(bindings)
+        with open(os.path.join(data_dir, f"{group_id}.json"), "w", encoding="utf-8") as f:
+            json.dump({"bindings": bindings}, f, ensure_ascii=False, indent=4)
+    return total, openids
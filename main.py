@@ -1,11 +1,12 @@
 # script/QFNUElectricityQuery/main.py
 
+import asyncio
 import logging
 import os
 import sys
 import re
+import time
 
-from urllib.parse import urlparse, parse_qs
 
 # 添加项目根目录到sys.path
 sys.path.append(
@@ -17,19 +18,66 @@ from app.api import send_group_msg, send_private_msg, delete_msg
 from app.switch import load_switch, save_switch
 from app.scripts.QFNUElectricityQuery.DataManager import DataManager
 from app.scripts.QFNUElectricityQuery.ElectricityQuery import ElectricityQuery
+from app.scripts.QFNUElectricityQuery.QueryResult import QueryResult
 from app.scripts.QFNUElectricityQuery.BalanceAlertManager import BalanceAlertManager
+from app.scripts.QFNUElectricityQuery.BalanceHistory import get_history
+from app.scripts.QFNUElectricityQuery.BindingTransfer import (
+    extract_openid,
+    parse_rows,
+    import_bindings,
+    export_bindings,
+    format_report,
+)
+from app.scripts.QFNUElectricityQuery.Metrics import (
+    metrics,
+    METRICS_FILE,
+    METRICS_EXPORT_INTERVAL,
+)
+
+# “正在查询”提示的回调关联 {触发查询的消息ID: {"expire_at": 过期时间, "message_id": 提示消息ID, "recall": 是否待撤回}}
+# 回调的echo中带有提示内容，提示回复的是触发查询的消息，按其中的消息ID取回记录，只撤回自己的提示
+PLACEHOLDER_TEXT = "🔍 正在查询电费信息..."
+PLACEHOLDER_ECHO_PATTERN = re.compile(r"\[CQ:reply,id=([^\]]+)\]" + re.escape(PLACEHOLDER_TEXT))
+# 查询在该时间（秒）内完成（如命中缓存）时不发送提示
+PLACEHOLDER_DELAY = float(os.getenv("QFNUEQ_PLACEHOLDER_DELAY", "0.5"))
+# 未收到回调或未被撤回的记录保留时间（秒）
+PLACEHOLDER_TTL = float(os.getenv("QFNUEQ_PLACEHOLDER_TTL", "120"))
+pending_placeholders = {}
+
+
+def prune_placeholders(now=None):
+    """清理已过期的提示记录，避免回调丢失时记录无限增长"""
+    now = time.monotonic() if now is None else now
+    expired = [
+        key for key, entry in pending_placeholders.items() if entry["expire_at"] <= now
+    ]
+    for key in expired:
+        del pending_placeholders[key]
 
-query_message_id = []
+
+# 功能开关缓存 {group_id: (状态, 过期时间)}
+# 本插件修改开关时直接更新缓存，其他插件的修改最多 SWITCH_CACHE_TTL 秒后可见
+SWITCH_CACHE_TTL = float(os.getenv("QFNUEQ_SWITCH_CACHE_TTL", "5"))
+switch_cache = {}
 
 
 # 查看功能开关状态
-def load_function_status(group_id):
-    return load_switch(group_id, "QFNUElectricityQuery")
+def load_function_status(group_id, refresh=False):
+    group_id = str(group_id)
+    now = time.monotonic()
+    cached = switch_cache.get(group_id)
+    if cached and not refresh and cached[1] > now:
+        return cached[0]
+    status = load_switch(group_id, "QFNUElectricityQuery")
+    switch_cache[group_id] = (status, now + SWITCH_CACHE_TTL)
+    return status
 
 
 # 保存功能开关状态
 def save_function_status(group_id, status):
+    group_id = str(group_id)
     save_switch(group_id, "QFNUElectricityQuery", status)
+    switch_cache[group_id] = (status, time.monotonic() + SWITCH_CACHE_TTL)
 
 
 # 处理开关状态
@@ -42,7 +90,8 @@ async def toggle_function_status(websocket, group_id, message_id, authorized):
         )
         return
 
-    if load_function_status(group_id):
+    # 切换前读取最新状态，避免基于过期缓存切换
+    if load_function_status(group_id, refresh=True):
         save_function_status(group_id, False)
         await send_group_msg(
             websocket,
@@ -68,141 +117,484 @@ async def send_help_menu(websocket, group_id, message_id):
         "电费绑定 链接 - 绑定你的微信openID链接\n"
         "查询 / 查电费 - 查询已绑定账号的电费余额\n"
         "电费解绑 - 解除当前账号的绑定\n"
+        "用电记录 [天数] - 查看最近几天每天的用电金额（默认7天，最多30天）\n"
+        "全群电费 [页码] - 查看本群所有绑定用户的余额 (管理员权限)\n"
+        "电费异常 - 查看本群连续查询失败的绑定 (管理员权限)\n"
+        "电费导入 数据 - 批量导入绑定，每行为 QQ号,链接 或 群号,QQ号,链接 (管理员权限)\n"
+        "电费导出 - 将所有群的绑定导出为CSV文件 (管理员权限)\n"
+        "qfnueqstats - 查看插件运行统计 (管理员权限)\n"
         "微信openID链接获取方法：1.搜索微信公众号【Qsd学生公寓】 2.点击下方菜单栏 3.进入页面之后 4.点击右上角，点击复制链接\n"
         "--------------------------"
     )
     await send_group_msg(websocket, group_id, f"[CQ:reply,id={message_id}]{menu_text}")
 
 
-# 提取 openID 的函数
-def extract_openid(link):
-    """从链接中提取openID"""
-    try:
-        parsed_url = urlparse(link)
-        # 尝试从查询参数中获取
-        query_params = parse_qs(parsed_url.query)
-        if "openId" in query_params:
-            return query_params["openId"][0]
-        # 尝试从片段标识符中获取（虽然示例中片段标识符也有，但优先用查询参数）
-        fragment_params = parse_qs(parsed_url.fragment)
-        if "openId" in fragment_params:
-            return fragment_params["openId"][0]
-        # 增加正则表达式匹配，作为备用方案
-        match = re.search(r"openId=([^&/#?]+)", link)
-        if match:
-            return match.group(1)
-    except Exception as e:
-        logging.error(f"Error extracting openID from link {link}: {e}")
-    return None
+# 发送用电记录
+async def send_usage_history(websocket, group_id, message_id, openid, days):
+    """根据余额历史统计最近days天每天的用电金额并回复"""
+    daily = await asyncio.to_thread(get_history().daily_consumption, openid, days)
+    if not daily:
+        await send_group_msg(
+            websocket,
+            group_id,
+            f"[CQ:reply,id={message_id}]📭 暂无足够的用电记录，每次查询电费后都会自动记录余额。",
+        )
+        return
 
+    lines = [f"📊 最近{days}天用电记录："]
+    for day, amount in daily:
+        lines.append(f"{day.strftime('%m-%d')}: {amount:.2f} 元")
+    total = sum(amount for _, amount in daily)
+    lines.append(f"合计: {total:.2f} 元，日均: {total / len(daily):.2f} 元")
+    await send_group_msg(
+        websocket, group_id, f"[CQ:reply,id={message_id}]" + "\n".join(lines)
+    )
 
-# 群消息处理函数
-async def handle_group_message(websocket, msg):
-    """处理群消息"""
-    try:
-        user_id = str(msg.get("user_id"))
-        group_id = str(msg.get("group_id"))
-        raw_message = str(msg.get("raw_message")).strip()  # 去除首尾空白
-        message_id = str(msg.get("message_id"))
-        authorized = user_id in owner_id
 
-        # 新增：处理菜单命令 (优先处理，不受开关影响)
-        if raw_message.lower() == "qfnueqmenu":
-            await send_help_menu(websocket, group_id, message_id)
-            return  # 处理完菜单命令后直接返回
+# 格式化查询结果
+def format_query_result(result):
+    """将QueryResult转换为回复文字"""
+    if result.status == QueryResult.OK:
+        # 余额只保留两位小数
+        return f"查询成功！\n余额: {result.balance:.2f}\n"
+    if result.status == QueryResult.INVALID_BALANCE:
+        return "查询成功！\n余额: 无效值\n"
+    if result.status == QueryResult.NOT_FOUND:
+        return "未找到电费信息，可能是你未绑定新校区宿舍户号信息，相关信息在物业提供的表格里"
+    return result.error or "查询失败，未知错误"
+
+
+# 全群电费报告的并发查询数和每页人数
+REPORT_CONCURRENCY = int(os.getenv("QFNUEQ_REPORT_CONCURRENCY", "20"))
+REPORT_PAGE_SIZE = int(os.getenv("QFNUEQ_REPORT_PAGE_SIZE", "40"))
+# 批量导入时同时验证的openID数量上限
+IMPORT_CONCURRENCY = int(os.getenv("QFNUEQ_IMPORT_CONCURRENCY", "10"))
+
+# 查询失败时在报告中显示的原因
+REPORT_FAILURE_REASONS = {
+    QueryResult.NOT_FOUND: "未找到户号信息",
+    QueryResult.INVALID_BALANCE: "余额无效",
+}
+
+
+# 发送全群电费报告
+async def send_group_report(websocket, group_id, message_id, page):
+    """并发查询本群所有绑定的余额，按余额从低到高分页回复，失败的单独列在最后"""
+    bindings = await DataManager(group_id).get_all_bindings()
+    if not bindings:
+        await send_group_msg(
+            websocket, group_id, f"[CQ:reply,id={message_id}]📭 本群还没有人绑定openID。"
+        )
+        return
 
-        # 处理开关命令
-        if raw_message.lower() == "qfnueq":
-            await toggle_function_status(websocket, group_id, message_id, authorized)
-            return
+    # 同一openID只查询一次
+    results = await electricity_query.query_many(bindings.values(), REPORT_CONCURRENCY)
+    succeeded = []
+    failed = []
+    for user_id, openid in bindings.items():
+        result = results[openid]
+        if result.ok:
+            succeeded.append((result.balance, user_id))
+        else:
+            failed.append(f"{user_id}: {REPORT_FAILURE_REASONS.get(result.status, '查询失败')}")
+    succeeded.sort()
+
+    lines = [
+        f"{index}. {user_id}: {balance:.2f} 元"
+        for index, (balance, user_id) in enumerate(succeeded, 1)
+    ]
+    if failed:
+        lines.append(f"❌ 查询失败（{len(failed)}人）：")
+        lines.extend(failed)
+
+    pages = (len(lines) + REPORT_PAGE_SIZE - 1) // REPORT_PAGE_SIZE
+    page = max(1, min(page, pages))
+    body = lines[(page - 1) * REPORT_PAGE_SIZE : page * REPORT_PAGE_SIZE]
+    header = (
+        f"📋 本群电费（{len(bindings)}人，成功{len(succeeded)}人，余额从低到高）"
+        f" 第{page}/{pages}页"
+    )
+    message = "\n".join([header] + body)
+    if pages > 1:
+        message += "\n发送【全群电费 页码】查看其他页"
+    await send_group_msg(websocket, group_id, f"[CQ:reply,id={message_id}]{message}")
+
+
+# 隔离状态中失败类型的显示名称
+FAILURE_KIND_NAMES = {
+    "not_found": "查不到户号",
+    "invalid_balance": "余额无效",
+    "http_error": "接口错误",
+    "timeout": "请求超时",
+}
+
+
+# 发送本群查询异常列表
+async def send_failure_report(websocket, group_id, message_id):
+    """列出本群绑定中被隔离（连续查询失败）的用户"""
+    failures = BalanceAlertManager.get_instance().failures
+    if not failures.loaded:
+        await asyncio.to_thread(failures.load)
+    bindings = await DataManager(group_id).get_all_bindings()
+    lines = []
+    for user_id, openid in bindings.items():
+        entry = failures.entries.get(openid)
+        if entry is None:
+            continue
+        next_attempt = time.strftime("%m-%d %H:%M", time.localtime(entry["next_attempt"]))
+        line = (
+            f"{user_id}: {FAILURE_KIND_NAMES.get(entry['kind'], entry['kind'])} "
+            f"连续{entry['count']}次，下次检查 {next_attempt}"
+        )
+        if entry["stale"]:
+            line += "【已失效】"
+        lines.append(line)
+    if not lines:
+        await send_group_msg(
+            websocket, group_id, f"[CQ:reply,id={message_id}]✅ 本群没有查询异常的绑定。"
+        )
+        return
+    await send_group_msg(
+        websocket,
+        group_id,
+        f"[CQ:reply,id={message_id}]⚠️ 本群查询异常的绑定（{len(lines)}人）：\n" + "\n".join(lines),
+    )
 
-        # 检查功能是否开启
-        if not load_function_status(group_id):
-            # 如果功能未开启，且不是开关命令，则不处理
-            if raw_message.lower() != "qfnueq":
-                return
-            # 如果是开关命令，则由上面的逻辑处理
 
-        # --- 功能开启后的逻辑 ---
-        data_manager = DataManager(group_id)
-        electricity_query = ElectricityQuery()  # 不再需要传入 openID
+# 发送运行统计
+async def send_stats(websocket, group_id, message_id):
+    """汇总运行指标并回复"""
+    if not metrics.enabled:
+        await send_group_msg(
+            websocket,
+            group_id,
+            f"[CQ:reply,id={message_id}]📭 运行指标未开启（QFNUEQ_METRICS=0）。",
+        )
+        return
 
-        # 绑定命令: 电费绑定 链接
-        bind_match = re.match(
-            r"^(?:电费绑定)\s+(https?://\S+)$", raw_message, re.IGNORECASE
+    # 先采集一次，刷新缓存、熔断器等由回调提供的数值
+    metrics.collect()
+    lines = ["📈 QFNUElectricityQuery 运行统计："]
+
+    upstream = metrics.histogram("qfnueq_upstream_request_seconds")
+    requests = metrics.counter_total("qfnueq_upstream_requests_total")
+    failed = requests - metrics.counter_value("qfnueq_upstream_requests_total", result="ok")
+    lines.append(f"上游请求: {requests} 次，失败 {failed} 次")
+    if upstream:
+        lines.append(
+            f"上游延迟: p50≤{upstream.quantile(0.5)}s p99≤{upstream.quantile(0.99)}s"
         )
-        if bind_match:
-            link = bind_match.group(1)
-            openid = extract_openid(link)
-            if openid:
-                if data_manager.bind_openid(user_id, openid):
-                    await send_group_msg(
-                        websocket,
-                        group_id,
-                        f"[CQ:reply,id={message_id}]✅ 绑定成功！，你现在可以撤回这条链接",
-                    )
-                else:
-                    await send_group_msg(
-                        websocket,
-                        group_id,
-                        f"[CQ:reply,id={message_id}]❌ 绑定失败，请稍后再试。",
-                    )
-            else:
-                await send_group_msg(
-                    websocket,
-                    group_id,
-                    f"[CQ:reply,id={message_id}]❌ 无法从链接中提取openID，请检查链接格式。",
-                )
-            return
+    hits = metrics.gauge_value("qfnueq_cache_hits", 0)
+    misses = metrics.gauge_value("qfnueq_cache_misses", 0)
+    if hits + misses:
+        lines.append(f"缓存命中率: {hits / (hits + misses):.0%}（{hits}/{hits + misses}）")
+    if metrics.gauge_value("qfnueq_circuit_open", 0):
+        lines.append("⚠️ 电费接口熔断中")
+
+    last_sweep = metrics.gauge_value("qfnueq_sweep_last_seconds")
+    if last_sweep is not None:
+        lines.append(
+            f"上次巡检: {last_sweep:.1f}s，检查 "
+            f"{metrics.gauge_value('qfnueq_sweep_openids_checked', 0)}/"
+            f"{metrics.gauge_value('qfnueq_sweep_openids_tracked', 0)} 个openID，"
+            f"提醒 {metrics.gauge_value('qfnueq_sweep_alerts', 0)} 人"
+        )
+    lines.append(
+        f"累计巡检: {metrics.counter_total('qfnueq_sweeps_total')} 次，"
+        f"提醒 {metrics.counter_total('qfnueq_alerts_total')} 人次"
+    )
+    lines.append(
+        f"隔离openID: {metrics.gauge_value('qfnueq_quarantined_openids', 0)} 个，"
+        f"其中失效 {metrics.gauge_value('qfnueq_stale_openids', 0)} 个"
+    )
+    lines.append(f"处理命令: {metrics.counter_total('qfnueq_commands_total')} 条")
+    await send_group_msg(
+        websocket, group_id, f"[CQ:reply,id={message_id}]" + "\n".join(lines)
+    )
+
+
+# 未绑定时的提示
+NOT_BOUND_TIP = "🤔 你还没有绑定openID，请使用【电费绑定 链接】命令进行绑定。链接获取方法：1.搜索微信公众号【Qsd学生公寓】 2.点击下方菜单栏 3.进入页面之后 4.点击右上角，点击复制链接"
+
+# 所有命令共用一个查询实例（连接池和缓存在实例间共享）
+electricity_query = ElectricityQuery()
+
+
+# 处理菜单命令
+async def handle_menu_command(websocket, group_id, user_id, message_id, match):
+    await send_help_menu(websocket, group_id, message_id)
+
+
+# 处理开关命令
+async def handle_toggle_command(websocket, group_id, user_id, message_id, match):
+    authorized = user_id in owner_id
+    await toggle_function_status(websocket, group_id, message_id, authorized)
+
+
+# 管理员命令的权限提示
+async def reply_owner_only(websocket, group_id, message_id, action):
+    await send_group_msg(
+        websocket,
+        group_id,
+        f"[CQ:reply,id={message_id}]❌ 只有管理员可以{action}。",
+    )
+
+
+# 运行统计命令: qfnueqstats
+async def handle_stats_command(websocket, group_id, user_id, message_id, match):
+    if user_id not in owner_id:
+        await reply_owner_only(websocket, group_id, message_id, "查看运行统计")
+        return
+    await send_stats(websocket, group_id, message_id)
+
+
+# 全群电费命令: 全群电费 [页码]
+async def handle_group_report_command(websocket, group_id, user_id, message_id, match):
+    if user_id not in owner_id:
+        await reply_owner_only(websocket, group_id, message_id, "查看全群电费")
+        return
+    await send_group_report(websocket, group_id, message_id, int(match.group(1) or 1))
+
+
+# 查询异常命令: 电费异常
+async def handle_failure_report_command(websocket, group_id, user_id, message_id, match):
+    if user_id not in owner_id:
+        await reply_owner_only(websocket, group_id, message_id, "查看查询异常")
+        return
+    await send_failure_report(websocket, group_id, message_id)
+
+
+# 消息中被转义的字符
+CQ_UNESCAPE = (("&#44;", ","), ("&#91;", "["), ("&#93;", "]"), ("&amp;", "&"))
+
+
+# 批量导入命令: 电费导入 数据
+async def handle_import_command(websocket, group_id, user_id, message_id, match):
+    if user_id not in owner_id:
+        await reply_owner_only(websocket, group_id, message_id, "批量导入绑定")
+        return
+    text = match.group(1)
+    for escaped, char in CQ_UNESCAPE:
+        text = text.replace(escaped, char)
+    text = text.strip()
+    fmt = "json" if text.startswith("[") else "csv"
+    rows, errors = parse_rows(text, fmt, default_group_id=group_id)
+    await send_group_msg(
+        websocket,
+        group_id,
+        f"[CQ:reply,id={message_id}]🔍 正在验证 {len(rows)} 条绑定...",
+    )
+    report = await import_bindings(rows, electricity_query, IMPORT_CONCURRENCY)
+    report["failures"] = sorted(errors + report["failures"])
+    await send_group_msg(
+        websocket, group_id, f"[CQ:reply,id={message_id}]{format_report(report)}"
+    )
 
-        # 查询命令: 查询 / 查电费
-        if raw_message in ["查询", "查电费", "query"]:  # 支持更多命令
-            openid = data_manager.get_openid(user_id)
-            if not openid:
-                await send_group_msg(
-                    websocket,
-                    group_id,
-                    f"[CQ:reply,id={message_id}]🤔 你还没有绑定openID，请使用【电费绑定 链接】命令进行绑定。链接获取方法：1.搜索微信公众号【Qsd学生公寓】 2.点击下方菜单栏 3.进入页面之后 4.点击右上角，点击复制链接",
-                )
-                return
 
-            # 发送正在查询提示
+# 导出的绑定文件保存目录
+EXPORT_DIR = os.path.join(DataManager.DATA_DIR, "exports")
+
+
+def write_export(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        return export_bindings(f)
+
+
+# 批量导出命令: 电费导出
+async def handle_export_command(websocket, group_id, user_id, message_id, match):
+    if user_id not in owner_id:
+        await reply_owner_only(websocket, group_id, message_id, "导出绑定")
+        return
+    # openID可直接查询他人电费，只写入本地文件，不发到群里
+    path = os.path.join(EXPORT_DIR, f"bindings-{time.strftime('%Y%m%d-%H%M%S')}.csv")
+    try:
+        count = await asyncio.to_thread(write_export, path)
+    except Exception as e:
+        logging.error(f"导出绑定到 {path} 时出错: {e}")
+        await send_group_msg(
+            websocket, group_id, f"[CQ:reply,id={message_id}]❌ 导出失败，请查看日志。"
+        )
+        return
+    await send_group_msg(
+        websocket,
+        group_id,
+        f"[CQ:reply,id={message_id}]✅ 已导出 {count} 条绑定到 {path}",
+    )
+
+
+# 绑定命令: 电费绑定 链接
+async def handle_bind_command(websocket, group_id, user_id, message_id, match):
+    link = match.group(1)
+    openid = extract_openid(link)
+    if openid:
+        if await DataManager(group_id).bind_openid(user_id, openid):
+            await send_group_msg(
+                websocket,
+                group_id,
+                f"[CQ:reply,id={message_id}]✅ 绑定成功！，你现在可以撤回这条链接",
+            )
+        else:
             await send_group_msg(
-                websocket, group_id, f"[CQ:reply,id={message_id}]🔍 正在查询电费信息..."
+                websocket,
+                group_id,
+                f"[CQ:reply,id={message_id}]❌ 绑定失败，请稍后再试。",
             )
+    else:
+        await send_group_msg(
+            websocket,
+            group_id,
+            f"[CQ:reply,id={message_id}]❌ 无法从链接中提取openID，请检查链接格式。",
+        )
 
-            # 异步执行查询
-            result = await electricity_query.parse_result(openid)
-            reply_message = f"[CQ:reply,id={message_id}]{result.get('message', '查询时发生未知错误。')}"
-
-            await send_group_msg(websocket, group_id, reply_message)
-            # 如果全局变量query_message_id不为空，则执行撤回函数并清空全局变量
-            global query_message_id
-            if query_message_id:
-                for message_id in query_message_id:
-                    await delete_msg(websocket, message_id)
-                query_message_id = []
+
+# 查询命令: 查询 / 查电费
+async def handle_query_command(websocket, group_id, user_id, message_id, match):
+    openid = await DataManager(group_id).find_openid(user_id)
+    if not openid:
+        await send_group_msg(
+            websocket, group_id, f"[CQ:reply,id={message_id}]{NOT_BOUND_TIP}"
+        )
+        return
+
+    # 异步执行查询，短时间内没有结果时才发送正在查询提示
+    task = asyncio.ensure_future(electricity_query.query(openid))
+    done, _ = await asyncio.wait({task}, timeout=PLACEHOLDER_DELAY)
+    if not done:
+        prune_placeholders()
+        pending_placeholders[message_id] = {
+            "expire_at": time.monotonic() + PLACEHOLDER_TTL,
+            "message_id": None,
+            "recall": False,
+        }
+        await send_group_msg(
+            websocket, group_id, f"[CQ:reply,id={message_id}]{PLACEHOLDER_TEXT}"
+        )
+
+    result = await task
+    reply_message = f"[CQ:reply,id={message_id}]{format_query_result(result)}"
+    await send_group_msg(websocket, group_id, reply_message)
+
+    if not done:
+        await recall_placeholder(websocket, message_id)
+
+
+# 撤回查询提示
+async def recall_placeholder(websocket, key):
+    """撤回回复key消息的提示；回调尚未到达时标记为待撤回，由回调处理"""
+    entry = pending_placeholders.get(key)
+    if entry is None:
+        return
+    if entry["message_id"] is None:
+        entry["recall"] = True
+        return
+    del pending_placeholders[key]
+    await delete_msg(websocket, entry["message_id"])
+
+
+# 解绑命令: 电费解绑
+async def handle_unbind_command(websocket, group_id, user_id, message_id, match):
+    if await DataManager(group_id).unbind_openid(user_id):
+        await send_group_msg(
+            websocket,
+            group_id,
+            f"[CQ:reply,id={message_id}]✅ 解绑成功！",
+        )
+    else:
+        # 可能用户本来就没绑定
+        await send_group_msg(
+            websocket,
+            group_id,
+            f"[CQ:reply,id={message_id}]🤔 你尚未绑定openID，无需解绑。",
+        )
+
+
+# 用电记录命令: 用电记录 [天数]
+async def handle_usage_command(websocket, group_id, user_id, message_id, match):
+    openid = await DataManager(group_id).find_openid(user_id)
+    if not openid:
+        await send_group_msg(
+            websocket, group_id, f"[CQ:reply,id={message_id}]{NOT_BOUND_TIP}"
+        )
+        return
+    days = max(1, min(int(match.group(1) or 7), 30))
+    await send_usage_history(websocket, group_id, message_id, openid, days)
+
+
+# 命令分发表，gated 表示是否需要本群开启功能
+# 不区分大小写、完全匹配的命令 {命令小写: (处理函数, gated)}
+CASELESS_COMMANDS = {
+    "qfnueqmenu": (handle_menu_command, False),  # 菜单不受开关影响
+    "qfnueq": (handle_toggle_command, False),
+    "qfnueqstats": (handle_stats_command, False),
+}
+# 完全匹配的命令 {命令: (处理函数, gated)}
+EXACT_COMMANDS = {
+    "查询": (handle_query_command, True),
+    "查电费": (handle_query_command, True),
+    "query": (handle_query_command, True),
+    "电费解绑": (handle_unbind_command, True),
+    "电费异常": (handle_failure_report_command, True),
+    "电费导出": (handle_export_command, True),
+}
+# 带参数的命令 [(前缀, 预编译正则, 处理函数, gated)]
+PATTERN_COMMANDS = [
+    ("电费绑定", re.compile(r"^(?:电费绑定)\s+(https?://\S+)$", re.IGNORECASE), handle_bind_command, True),
+    ("用电记录", re.compile(r"^用电记录(?:\s*(\d+))?$"), handle_usage_command, True),
+    ("全群电费", re.compile(r"^全群电费(?:\s*(\d+))?$"), handle_group_report_command, True),
+    ("电费导入", re.compile(r"^电费导入\s+(.+)$", re.DOTALL), handle_import_command, True),
+]
+# 所有命令可能的首字符，用于在任何其他处理之前快速排除普通聊天消息
+COMMAND_INITIALS = frozenset(
+    [c[0] for c in CASELESS_COMMANDS]
+    + [c[0].upper() for c in CASELESS_COMMANDS]
+    + [c[0] for c in EXACT_COMMANDS]
+    + [prefix[0] for prefix, _, _, _ in PATTERN_COMMANDS]
+)
+
+
+def route_command(raw_message):
+    """匹配命令，返回 (处理函数, gated, 正则匹配结果)，不是命令时返回None"""
+    if not raw_message or raw_message[0] not in COMMAND_INITIALS:
+        return None
+    command = EXACT_COMMANDS.get(raw_message)
+    if command:
+        return command[0], command[1], None
+    command = CASELESS_COMMANDS.get(raw_message.lower())
+    if command:
+        return command[0], command[1], None
+    for prefix, pattern, handler, gated in PATTERN_COMMANDS:
+        if raw_message.startswith(prefix):
+            match = pattern.match(raw_message)
+            if match:
+                return handler, gated, match
+    return None
+
+
+# 群消息处理函数
+async def handle_group_message(websocket, msg):
+    """处理群消息"""
+    try:
+        raw_message = str(msg.get("raw_message")).strip()  # 去除首尾空白
+
+        # 绝大多数聊天消息不是命令，在读取开关或存储之前直接返回
+        route = route_command(raw_message)
+        if route is None:
             return
+        handler, gated, match = route
 
-        # 解绑命令: 电费解绑
-        if raw_message in ["电费解绑"]:
-            if data_manager.unbind_openid(user_id):
-                await send_group_msg(
-                    websocket,
-                    group_id,
-                    f"[CQ:reply,id={message_id}]✅ 解绑成功！",
-                )
-            else:
-                # 可能用户本来就没绑定
-                await send_group_msg(
-                    websocket,
-                    group_id,
-                    f"[CQ:reply,id={message_id}]🤔 你尚未绑定openID，无需解绑。",
-                )
+        user_id = str(msg.get("user_id"))
+        group_id = str(msg.get("group_id"))
+        message_id = str(msg.get("message_id"))
+
+        # 检查功能是否开启（菜单和开关命令不受影响）
+        if gated and not load_function_status(group_id):
             return
 
-        # 其他群消息处理逻辑 (如果需要的话)
-        # pass
+        command = handler.__name__
+        metrics.inc("qfnueq_commands_total", command=command)
+        with metrics.timer("qfnueq_command_seconds", command=command):
+            await handler(websocket, group_id, user_id, message_id, match)
 
     except Exception as e:
         logging.error(f"处理QFNUElectricityQuery群消息失败: {e}")
@@ -221,10 +613,17 @@ async def handle_response(websocket, msg):
     """处理回调事件"""
     try:
         echo = msg.get("echo")
-        if echo and "正在查询电费信息" in echo:
-            # 存储消息id到全局变量
-            global query_message_id
-            query_message_id.append(msg.get("data").get("message_id"))
+        match = PLACEHOLDER_ECHO_PATTERN.search(echo) if echo else None
+        if match:
+            key = match.group(1)
+            entry = pending_placeholders.get(key)
+            if entry is None:
+                # 记录已过期，提示消息保留在群里
+                return
+            entry["message_id"] = msg.get("data").get("message_id")
+            if entry["recall"]:
+                # 查询先于回调完成，收到消息ID后立即撤回
+                await recall_placeholder(websocket, key)
     except Exception as e:
         logging.error(f"处理QFNUElectricityQuery回调事件失败: {e}")
         return
@@ -243,14 +642,25 @@ async def handle_request_event(websocket, msg):
 
 # 检查余额函数
 async def check_and_send_balance_alert(websocket):
-    """检查余额并发送提醒"""
+    """确保后台余额巡检任务在运行，巡检本身不会阻塞心跳处理"""
     try:
-        balance_manager = BalanceAlertManager()
-        await balance_manager.check_and_alert(websocket)
+        BalanceAlertManager.get_instance().start(websocket)
+        # 借助心跳定期导出运行指标
+        await metrics.maybe_export(METRICS_FILE, METRICS_EXPORT_INTERVAL)
     except Exception as e:
         logging.error(f"检查余额并发送提醒失败: {e}")
 
 
+# 资源清理函数，在机器人退出前调用
+async def shutdown():
+    """释放插件持有的共享资源"""
+    try:
+        await BalanceAlertManager.shutdown()
+        await ElectricityQuery.close_session()
+    except Exception as e:
+        logging.error(f"释放QFNUElectricityQuery资源失败: {e}")
+
+
 # 统一事件处理入口
 async def handle_events(websocket, msg):
     """统一事件处理入口"""